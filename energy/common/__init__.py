@@ -0,0 +1,3 @@
+##
+# Modules shared by all the energy scripts
+##
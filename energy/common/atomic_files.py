@@ -0,0 +1,90 @@
+##
+# Atomic writes of the files generated by the energy scripts (reports, caches, watermarks...).
+# Data is written into a temporary file in the same directory, with a unique name so that runs at the same time
+# never write into the same temporary file, and the temporary file replaces the file only when it is complete.
+# Readers never see a partial file and an interrupted run never leaves a corrupted file.
+# Data can be compressed on the fly with gzip or, with the optional package zstandard, with zstd.
+##
+from contextlib import contextmanager
+import gzip
+import io
+import os
+import uuid
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressions of the files and extensions they add to the file names
+COMPRESSIONS:dict = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+# Size in bytes of the buffers used to write the files
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+##
+# Check that a compression can be written
+##
+def check_compression_available(compression:str):
+
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}. Use one of: {', '.join(COMPRESSIONS)}.")
+
+    if compression == "zstd" and zstandard is None:
+        raise RuntimeError("The zstd compression needs the package zstandard. Install it with: pip install zstandard")
+
+##
+# Get a unique path for the temporary file of a file, in the same directory so that it can replace the file
+##
+def get_temporary_file_path(file_path:str)-> str:
+    return f"{file_path}.{uuid.uuid4().hex}.tmp"
+
+##
+# Replace a file with its complete temporary file
+##
+def replace_file(temporary_file_path:str, file_path:str):
+    os.replace(temporary_file_path, file_path)
+
+##
+# Remove the temporary file of a write that did not finish, if it exists
+##
+def remove_temporary_file(temporary_file_path:str):
+
+    if os.path.exists(temporary_file_path):
+        os.remove(temporary_file_path)
+
+##
+# Open a binary file to be written atomically: data is written into a temporary file that replaces
+# the file when the block finishes without errors, and that is removed otherwise
+##
+@contextmanager
+def open_atomic_file(file_path:str, compression:str="none"):
+
+    check_compression_available(compression)
+
+    temporary_file_path:str = get_temporary_file_path(file_path)
+
+    try:
+        with open(temporary_file_path, mode='xb', buffering=WRITE_BUFFER_SIZE) as file:
+
+            if compression == "none":
+                yield file
+            else:
+                if compression == "gzip":
+                    # No timestamp in the header, so the same content always gives the same file
+                    stream = gzip.GzipFile(fileobj=file, mode='wb', compresslevel=6, mtime=0)
+                else:
+                    stream = zstandard.ZstdCompressor(level=3).stream_writer(file, closefd=False)
+
+                # Compress big blocks instead of every small write
+                buffered_stream = io.BufferedWriter(stream, buffer_size=WRITE_BUFFER_SIZE)
+                yield buffered_stream
+
+                # Closing the stream writes the end of the compressed data, the file is closed afterwards
+                buffered_stream.close()
+
+        replace_file(temporary_file_path, file_path)
+
+    except BaseException:
+        remove_temporary_file(temporary_file_path)
+        raise
@@ -0,0 +1,685 @@
+##
+# In-memory stand-in for InfluxDB, used to run the energy scripts without a live database.
+# It implements the subset of the InfluxDB client used by the scripts:
+# - write_points: stores the points and records the line protocol that would have been sent
+# - query: answers the InfluxQL queries issued by the scripts:
+#   SELECT <fields or SUM/COUNT/MEAN/MIN/MAX/FIRST/LAST(field) [AS alias]> FROM <measurement>
+#   [WHERE <time, tag and field conditions joined by AND/OR>]
+#   [GROUP BY <tags>, time(<interval>) [fill(...)]] [ORDER BY time [DESC]] [LIMIT n] [tz('<time zone>')]
+#   Many statements separated by ";" are answered in a single request with a list of results, like the real client does.
+# It also counts the queries, write requests and points written, so it can be used to benchmark the scripts.
+##
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+import re
+import pytz
+from influxdb.line_protocol import make_lines
+from influxdb.resultset import ResultSet
+
+# Nanoseconds by time unit
+NANOSECONDS:dict = {"ns": 1, "u": 1000, "µ": 1000, "ms": 1000000, "s": 1000000000, "m": 60000000000, "h": 3600000000000, "d": 86400000000000, "w": 604800000000000}
+
+AGGREGATES:tuple = ("sum", "count", "mean", "min", "max", "first", "last")
+
+##
+# Split a query into its statements, separated by ";" outside quotes
+##
+def split_statements(query:str)-> list:
+
+    statements:list = []
+    current:list = []
+    quote:str = None
+    for character in query:
+        if quote is not None:
+            if character == quote:
+                quote = None
+        elif character in ("'", '"'):
+            quote = character
+        elif character == ";":
+            statements.append("".join(current))
+            current = []
+            continue
+        current.append(character)
+    statements.append("".join(current))
+
+    return [statement.strip() for statement in statements if statement.strip()]
+
+##
+# Transform a time value of a point (string in RFC3339 format, datetime or number in the given precision) into nanoseconds
+##
+def get_time_ns(value, precision:str=None)-> int:
+
+    if isinstance(value, (int, float)):
+        return int(value * NANOSECONDS[precision or "ns"])
+
+    if isinstance(value, str):
+        value = parse_rfc3339(value)
+
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=pytz.utc)
+
+    delta:timedelta = value - datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+    return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
+
+##
+# Parse a date in RFC3339 format
+##
+def parse_rfc3339(value:str)-> datetime:
+
+    match = re.fullmatch(r"(\d{4}-\d{2}-\d{2})(?:[T ](\d{2}:\d{2}:\d{2})(?:\.(\d+))?)?(Z|[+-]\d{2}:\d{2})?", value.strip())
+    if match is None:
+        raise ValueError(f"Invalid time {value}.")
+
+    date, time, fraction, offset = match.groups()
+    parsed:datetime = datetime.strptime(f"{date}T{time or '00:00:00'}", "%Y-%m-%dT%H:%M:%S")
+
+    if fraction:
+        parsed = parsed.replace(microsecond=int(fraction[:6].ljust(6, "0")))
+
+    if offset and offset != "Z":
+        sign:int = 1 if offset[0] == "+" else -1
+        parsed = parsed - sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[4:6]))
+
+    return parsed.replace(tzinfo=pytz.utc)
+
+##
+# Transform nanoseconds into a date in RFC3339 format, in UTC or in a time zone
+##
+def format_time_ns(time_ns:int, timezone=None)-> str:
+
+    utc_datetime:datetime = datetime(1970, 1, 1, tzinfo=pytz.utc) + timedelta(microseconds=time_ns // 1000)
+
+    if timezone is None:
+        return utc_datetime.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    return utc_datetime.astimezone(timezone).isoformat()
+
+##
+# Split InfluxQL into tokens
+##
+TOKEN_PATTERN = re.compile(r"""\s*(?:
+    (?P<string>'(?:[^'\\]|\\.)*')|
+    (?P<identifier>"(?:[^"\\]|\\.)*")|
+    (?P<regex>/(?:[^/\\]|\\.)*/)|
+    (?P<duration>\d+(?:ns|u|µ|ms|s|m|h|d|w)\b)|
+    (?P<number>-?\d+(?:\.\d+)?)|
+    (?P<operator>=~|!~|!=|<>|>=|<=|=|<|>|\+|-|\(|\)|,|\*)|
+    (?P<word>[A-Za-z_][\w.-]*)
+    )""", re.VERBOSE)
+
+def tokenize(text:str)-> list:
+
+    tokens:list = []
+    position:int = 0
+    text = text.strip().rstrip(";")
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None or match.end() == position:
+            if text[position:].strip() == "":
+                break
+            raise ValueError(f"Unsupported query near: {text[position:]}")
+        position = match.end()
+        kind:str = match.lastgroup
+        value:str = match.group(kind)
+        if kind == "string":
+            value = value[1:-1].replace("\\'", "'")
+        elif kind == "identifier":
+            value = value[1:-1].replace('\\"', '"')
+        elif kind == "regex":
+            value = value[1:-1].replace("\\/", "/")
+        tokens.append((kind, value))
+
+    return tokens
+
+##
+# Parser of the InfluxQL queries supported by the fake client
+##
+class QueryParser:
+
+    def __init__(self, query:str):
+        self.tokens:list = tokenize(query)
+        self.position:int = 0
+
+    def peek(self, offset:int=0):
+        position:int = self.position + offset
+        return self.tokens[position] if position < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def is_keyword(self, keyword:str, offset:int=0)-> bool:
+        kind, value = self.peek(offset)
+        return kind == "word" and value.upper() == keyword
+
+    def expect_keyword(self, keyword:str):
+        if not self.is_keyword(keyword):
+            raise ValueError(f"Expected {keyword} in query, found {self.peek()[1]}.")
+        self.next()
+
+    def expect(self, value:str):
+        if self.peek()[1] != value:
+            raise ValueError(f"Expected {value} in query, found {self.peek()[1]}.")
+        self.next()
+
+    def parse(self)-> dict:
+
+        self.expect_keyword("SELECT")
+
+        query:dict = {"fields": self.parse_fields(), "where": None, "group_tags": [], "group_interval": None, "fill": "null", "descending": False, "limit": None, "timezone": None}
+
+        self.expect_keyword("FROM")
+        query["measurement"] = self.next()[1]
+
+        while self.peek()[0] is not None:
+            if self.is_keyword("WHERE"):
+                self.next()
+                query["where"] = self.parse_or()
+            elif self.is_keyword("GROUP"):
+                self.next()
+                self.expect_keyword("BY")
+                self.parse_group_by(query)
+            elif self.is_keyword("FILL"):
+                self.next()
+                self.expect("(")
+                query["fill"] = self.next()[1].lower()
+                self.expect(")")
+            elif self.is_keyword("ORDER"):
+                self.next()
+                self.expect_keyword("BY")
+                self.next()
+                if self.is_keyword("DESC") or self.is_keyword("ASC"):
+                    query["descending"] = self.next()[1].upper() == "DESC"
+            elif self.is_keyword("LIMIT"):
+                self.next()
+                query["limit"] = int(self.next()[1])
+            elif self.is_keyword("TZ"):
+                self.next()
+                self.expect("(")
+                query["timezone"] = pytz.timezone(self.next()[1])
+                self.expect(")")
+            else:
+                raise ValueError(f"Unsupported query clause {self.peek()[1]}.")
+
+        return query
+
+    def parse_fields(self)-> list:
+
+        fields:list = []
+        while True:
+            if self.peek()[1] == "*":
+                self.next()
+                fields.append({"function": None, "field": "*", "name": "*"})
+            elif self.peek()[0] == "word" and self.peek(1)[1] == "(":
+                function:str = self.next()[1].lower()
+                if function not in AGGREGATES:
+                    raise ValueError(f"Unsupported function {function}.")
+                self.expect("(")
+                field:str = self.next()[1]
+                self.expect(")")
+                fields.append({"function": function, "field": field, "name": function})
+            else:
+                field:str = self.next()[1]
+                fields.append({"function": None, "field": field, "name": field})
+
+            if self.is_keyword("AS"):
+                self.next()
+                fields[-1]["name"] = self.next()[1]
+
+            if self.peek()[1] != ",":
+                return fields
+            self.next()
+
+    def parse_group_by(self, query:dict):
+
+        while True:
+            if self.is_keyword("TIME") and self.peek(1)[1] == "(":
+                self.next()
+                self.expect("(")
+                query["group_interval"] = get_duration_ns(self.next()[1])
+                self.expect(")")
+            elif self.peek()[1] == "*":
+                self.next()
+                query["group_tags"] = "*"
+            else:
+                query["group_tags"].append(self.next()[1])
+
+            if self.peek()[1] != ",":
+                return
+            self.next()
+
+    def parse_or(self):
+
+        node = self.parse_and()
+        while self.is_keyword("OR"):
+            self.next()
+            node = ("or", node, self.parse_and())
+
+        return node
+
+    def parse_and(self):
+
+        node = self.parse_condition()
+        while self.is_keyword("AND"):
+            self.next()
+            node = ("and", node, self.parse_condition())
+
+        return node
+
+    def parse_condition(self):
+
+        if self.peek()[1] == "(":
+            self.next()
+            node = self.parse_or()
+            self.expect(")")
+            return node
+
+        left:str = self.next()[1]
+        operator:str = self.next()[1]
+        if left.lower() == "time":
+            return ("time", operator, self.parse_time_value())
+
+        kind, value = self.next()
+        if kind == "number":
+            value = float(value)
+        elif kind == "word" and value.lower() in ("true", "false"):
+            value = value.lower() == "true"
+
+        return ("compare", left, operator, value, kind)
+
+    def parse_time_value(self)-> int:
+
+        kind, value = self.next()
+
+        if kind == "string":
+            time_ns:int = get_time_ns(value)
+        elif kind == "duration":
+            time_ns:int = get_duration_ns(value)
+        elif kind == "number":
+            time_ns:int = int(value)
+        elif kind == "word" and value.lower() == "now":
+            self.expect("(")
+            self.expect(")")
+            time_ns:int = get_time_ns(datetime.now(pytz.utc))
+        else:
+            raise ValueError(f"Unsupported time value {value}.")
+
+        # Time arithmetic, for example now() - 30d
+        while self.peek()[1] in ("+", "-"):
+            sign:int = 1 if self.next()[1] == "+" else -1
+            time_ns += sign * get_duration_ns(self.next()[1])
+
+        return time_ns
+
+##
+# Transform a duration literal like "1h" or "30d" into nanoseconds
+##
+def get_duration_ns(duration:str)-> int:
+
+    match = re.fullmatch(r"(\d+)(ns|u|µ|ms|s|m|h|d|w)", duration)
+    if match is None:
+        raise ValueError(f"Invalid duration {duration}.")
+
+    return int(match.group(1)) * NANOSECONDS[match.group(2)]
+
+##
+# Get the lower and upper time bounds of a WHERE condition, looking only at the conditions joined by AND
+##
+def get_time_bounds(node)-> tuple:
+
+    lower, upper = None, None
+    if node is None:
+        return lower, upper
+
+    if node[0] == "and":
+        left_lower, left_upper = get_time_bounds(node[1])
+        right_lower, right_upper = get_time_bounds(node[2])
+        lowers:list = [bound for bound in (left_lower, right_lower) if bound is not None]
+        uppers:list = [bound for bound in (left_upper, right_upper) if bound is not None]
+        return (max(lowers) if lowers else None), (min(uppers) if uppers else None)
+
+    if node[0] == "time":
+        operator, time_ns = node[1], node[2]
+        if operator == ">=":
+            return time_ns, None
+        if operator == ">":
+            return time_ns + 1, None
+        if operator == "<=":
+            return None, time_ns
+        if operator == "<":
+            return None, time_ns - 1
+        if operator == "=":
+            return time_ns, time_ns
+
+    if node[0] == "or":
+        left_lower, left_upper = get_time_bounds(node[1])
+        right_lower, right_upper = get_time_bounds(node[2])
+        lower = min(left_lower, right_lower) if left_lower is not None and right_lower is not None else None
+        upper = max(left_upper, right_upper) if left_upper is not None and right_upper is not None else None
+
+    return lower, upper
+
+##
+# Compare two values with an InfluxQL operator
+##
+def compare(left, operator:str, right)-> bool:
+
+    if operator in ("=~", "!~"):
+        matches:bool = left is not None and re.search(right, str(left)) is not None
+        return matches if operator == "=~" else not matches
+
+    if left is None:
+        return operator in ("!=", "<>")
+
+    try:
+        if operator == "=":
+            return left == right
+        if operator in ("!=", "<>"):
+            return left != right
+        if operator == ">=":
+            return left >= right
+        if operator == "<=":
+            return left <= right
+        if operator == ">":
+            return left > right
+        if operator == "<":
+            return left < right
+    except TypeError:
+        return False
+
+    raise ValueError(f"Unsupported operator {operator}.")
+
+##
+# Evaluate a WHERE condition for a point
+##
+def evaluate(node, time_ns:int, tags:dict, fields:dict)-> bool:
+
+    if node is None:
+        return True
+
+    if node[0] == "and":
+        return evaluate(node[1], time_ns, tags, fields) and evaluate(node[2], time_ns, tags, fields)
+
+    if node[0] == "or":
+        return evaluate(node[1], time_ns, tags, fields) or evaluate(node[2], time_ns, tags, fields)
+
+    if node[0] == "time":
+        return compare(time_ns, node[1], node[2])
+
+    key, operator, value, kind = node[1], node[2], node[3], node[4]
+
+    # Tag values are always strings
+    if key in tags:
+        return compare(tags[key], operator, value if isinstance(value, str) else str(value))
+
+    return compare(fields.get(key), operator, value)
+
+##
+# Aggregate a list of (time, value) tuples, sorted by time
+##
+def aggregate(function:str, values:list):
+
+    values = [(time_ns, value) for time_ns, value in values if value is not None]
+
+    if function == "count":
+        return len(values)
+
+    if len(values) == 0:
+        return None
+
+    if function == "sum":
+        return sum(value for time_ns, value in values)
+    if function == "mean":
+        return sum(value for time_ns, value in values) / len(values)
+    if function == "min":
+        return min(value for time_ns, value in values)
+    if function == "max":
+        return max(value for time_ns, value in values)
+    if function == "first":
+        return values[0][1]
+    if function == "last":
+        return values[-1][1]
+
+    raise ValueError(f"Unsupported function {function}.")
+
+class FakeInfluxDBClient:
+
+    def __init__(self, record_lines:bool=True):
+
+        # Points by measurement: time -> series key -> (tags, fields)
+        self.measurements:dict = {}
+        # Sorted times by measurement, rebuilt when new times are written
+        self.sorted_times:dict = {}
+
+        self.record_lines:bool = record_lines
+        self.lines:list = []
+
+        self.queries:list = []
+        self.query_count:int = 0
+        self.write_request_count:int = 0
+        self.points_written:int = 0
+
+    ##
+    # Forget the counters and the recorded line protocol, keeping the stored points
+    ##
+    def reset_counters(self):
+        self.lines = []
+        self.queries = []
+        self.query_count = 0
+        self.write_request_count = 0
+        self.points_written = 0
+
+    def close(self):
+        pass
+
+    def write_points(self, points, time_precision=None, database=None, retention_policy=None, tags=None, batch_size=None, protocol='json', consistency=None)-> bool:
+
+        points = list(points)
+        batch_size = batch_size if batch_size and batch_size > 0 else max(len(points), 1)
+
+        for batch_start in range(0, len(points), batch_size):
+            batch:list = points[batch_start:batch_start + batch_size]
+
+            self.write_request_count += 1
+            self.points_written += len(batch)
+
+            if self.record_lines:
+                self.lines.extend(make_lines({"points": batch, "tags": tags}, time_precision).splitlines())
+
+            for point in batch:
+                self.store_point(point, time_precision, tags)
+
+        return True
+
+    ##
+    # Store a point, replacing any point of the same series with the same time like InfluxDB does
+    ##
+    def store_point(self, point:dict, time_precision:str=None, default_tags:dict=None):
+
+        measurement:str = point["measurement"]
+        time_ns:int = get_time_ns(point["time"], time_precision)
+
+        point_tags:dict = dict(default_tags or {})
+        point_tags.update(point.get("tags") or {})
+        point_tags = {key: str(value) for key, value in point_tags.items() if value is not None}
+        series_key:tuple = tuple(sorted(point_tags.items()))
+
+        points_by_time:dict = self.measurements.setdefault(measurement, {})
+        if time_ns not in points_by_time:
+            points_by_time[time_ns] = {}
+            self.sorted_times.pop(measurement, None)
+
+        series:dict = points_by_time[time_ns]
+        fields:dict = {key: value for key, value in point["fields"].items() if value is not None}
+        if series_key in series:
+            series[series_key][1].update(fields)
+        else:
+            series[series_key] = (point_tags, fields)
+
+    ##
+    # Get the points of a measurement between two times, sorted by time
+    ##
+    def get_points_between(self, measurement:str, lower:int, upper:int):
+
+        points_by_time:dict = self.measurements.get(measurement, {})
+
+        if measurement not in self.sorted_times:
+            self.sorted_times[measurement] = sorted(points_by_time)
+        times:list = self.sorted_times[measurement]
+
+        first:int = bisect_left(times, lower) if lower is not None else 0
+        last:int = bisect_right(times, upper) if upper is not None else len(times)
+
+        for time_ns in times[first:last]:
+            for tags, fields in points_by_time[time_ns].values():
+                yield time_ns, tags, fields
+
+    def query(self, query:str, params=None, bind_params=None, epoch=None, expected_response_code=200, database=None, raise_errors=True, chunked=False, chunk_size=0, method="GET")-> ResultSet:
+
+        self.query_count += 1
+        self.queries.append(query)
+
+        # A single statement returns its result, many statements return the list of their results
+        results:list = [self.query_statement(statement) for statement in split_statements(query)]
+
+        return results[0] if len(results) == 1 else results
+
+    ##
+    # Answer a single InfluxQL statement
+    ##
+    def query_statement(self, query:str)-> ResultSet:
+
+        parsed:dict = QueryParser(query).parse()
+        lower, upper = get_time_bounds(parsed["where"])
+
+        # Select the points and group them by series
+        series:dict = {}
+        tag_keys:set = set()
+        for time_ns, tags, fields in self.get_points_between(parsed["measurement"], lower, upper):
+            if not evaluate(parsed["where"], time_ns, tags, fields):
+                continue
+
+            tag_keys.update(tags)
+            if parsed["group_tags"] == "*":
+                group:tuple = tuple(sorted(tags.items()))
+            else:
+                group:tuple = tuple((tag, tags.get(tag, "")) for tag in parsed["group_tags"])
+
+            series.setdefault(group, []).append((time_ns, tags, fields))
+
+        is_aggregate:bool = any(field["function"] is not None for field in parsed["fields"])
+
+        result_series:list = []
+        for group, points in sorted(series.items()):
+
+            if is_aggregate:
+                columns, values = self.aggregate_points(parsed, points, lower, upper)
+            else:
+                columns, values = self.select_points(parsed, points, tag_keys, dict(group))
+
+            if parsed["descending"]:
+                values.reverse()
+            if parsed["limit"] is not None:
+                values = values[:parsed["limit"]]
+
+            if len(values) == 0:
+                continue
+
+            serie:dict = {"name": parsed["measurement"], "columns": columns, "values": values}
+            if parsed["group_tags"]:
+                serie["tags"] = dict(group)
+            result_series.append(serie)
+
+        if len(result_series) == 0:
+            return ResultSet({})
+
+        return ResultSet({"series": result_series})
+
+    ##
+    # Build the rows of a query without aggregates
+    ##
+    def select_points(self, parsed:dict, points:list, tag_keys:set, group_tags:dict)-> tuple:
+
+        names:list = []
+        for field in parsed["fields"]:
+            if field["field"] == "*":
+                field_keys:set = set()
+                for time_ns, tags, fields in points:
+                    field_keys.update(fields)
+                names.extend(sorted((field_keys | tag_keys) - set(group_tags)))
+            else:
+                names.append(field["field"])
+
+        aliases:dict = {field["field"]: field["name"] for field in parsed["fields"]}
+        columns:list = ["time"] + [aliases.get(name, name) for name in names]
+
+        values:list = []
+        for time_ns, tags, fields in points:
+            values.append([format_time_ns(time_ns, parsed["timezone"])] + [fields.get(name, tags.get(name)) for name in names])
+
+        return columns, values
+
+    ##
+    # Build the rows of a query with aggregates, by time interval if the query is grouped by time
+    ##
+    def aggregate_points(self, parsed:dict, points:list, lower:int, upper:int)-> tuple:
+
+        columns:list = ["time"] + [field["name"] for field in parsed["fields"]]
+        interval:int = parsed["group_interval"]
+
+        if interval is None:
+            bucket_starts:list = [lower if lower is not None else 0]
+        else:
+            first:int = lower if lower is not None else points[0][0]
+            last:int = upper if upper is not None else points[-1][0]
+            bucket_starts:list = self.get_bucket_starts(first, last, interval, parsed["timezone"])
+
+        buckets:list = [[] for bucket_start in bucket_starts]
+        for point in points:
+            bucket_index:int = bisect_right(bucket_starts, point[0]) - 1
+            if bucket_index >= 0:
+                buckets[bucket_index].append(point)
+
+        values:list = []
+        for bucket_start, bucket_points in zip(bucket_starts, buckets):
+
+            if len(bucket_points) == 0 and parsed["fill"] == "none":
+                continue
+
+            row:list = [format_time_ns(bucket_start, parsed["timezone"])]
+            for field in parsed["fields"]:
+                value = aggregate(field["function"], [(time_ns, fields.get(field["field"])) for time_ns, tags, fields in bucket_points])
+                if value is None and parsed["fill"] not in ("null", "none", "previous", "linear"):
+                    value = float(parsed["fill"])
+                row.append(value)
+
+            values.append(row)
+
+        return columns, values
+
+    ##
+    # Get the start of every time interval between two times. With a time zone, days start at local midnight.
+    ##
+    def get_bucket_starts(self, first:int, last:int, interval:int, timezone)-> list:
+
+        if timezone is None:
+            bucket_start:int = first - first % interval
+            return list(range(bucket_start, last + 1, interval))
+
+        if interval % NANOSECONDS["d"] != 0:
+            bucket_start:int = first - first % interval
+            return list(range(bucket_start, last + 1, interval))
+
+        days:int = interval // NANOSECONDS["d"]
+        local_first:datetime = (datetime(1970, 1, 1, tzinfo=pytz.utc) + timedelta(microseconds=first // 1000)).astimezone(timezone)
+        local_day:datetime = datetime(local_first.year, local_first.month, local_first.day)
+
+        bucket_starts:list = []
+        while True:
+            bucket_start:int = get_time_ns(timezone.localize(local_day))
+            if bucket_start > last:
+                return bucket_starts
+            bucket_starts.append(bucket_start)
+            local_day += timedelta(days=days)
@@ -0,0 +1,104 @@
+##
+# Buffered writer of points into InfluxDB.
+# Instead of sending an HTTP request for every point, points are collected in memory and written
+# in batches. The buffer is flushed when:
+# - it reaches the batch size
+# - the flush interval has passed since the last flush
+# - the writer is closed
+##
+import logging
+import time
+from influxdb import InfluxDBClient
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_FLUSH_INTERVAL_SECONDS = 10.0
+
+class InfluxDBPointsWriter:
+
+    def __init__(self, client:InfluxDBClient, batch_size:int=DEFAULT_BATCH_SIZE, flush_interval:float=DEFAULT_FLUSH_INTERVAL_SECONDS, time_precision:str='s'):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.time_precision = time_precision
+        self.points:list = []
+        self.points_flushed:int = 0
+        self.last_flush_time:float = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    ##
+    # Flush the pending points only when the block finished without errors. When it failed, only the points not flushed
+    # yet are dropped: the batches flushed by size or by time during the block are already written into InfluxDB
+    ##
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    ##
+    # Add a point to the buffer, flushing it if it is full or the flush interval has passed
+    ##
+    def write(self, point:dict):
+
+        self.points.append(point)
+
+        if len(self.points) >= self.batch_size or (time.monotonic() - self.last_flush_time) >= self.flush_interval:
+            self.flush()
+
+    ##
+    # Add a list of points to the buffer
+    ##
+    def write_all(self, points:list):
+        for point in points:
+            self.write(point)
+
+    ##
+    # Write all the buffered points into InfluxDB and return how many points were written
+    ##
+    def flush(self)-> int:
+
+        points_count:int = len(self.points)
+
+        if points_count > 0:
+            # The buffer is emptied before writing, so points rejected by InfluxDB are not sent again by the next flush
+            points:list = self.points
+            self.points = []
+
+            try:
+                self.client.write_points(points, batch_size=self.batch_size, time_precision=self.time_precision)
+            except Exception as e:
+                logging.error(f"Error writing {points_count} points into InfluxDB: {e}")
+                raise e
+
+            self.points_flushed += points_count
+            logging.debug(f"Flushed {points_count} points into InfluxDB.")
+
+        self.last_flush_time = time.monotonic()
+
+        return points_count
+
+    ##
+    # Flush the pending points and return the total number of points written by this writer
+    ##
+    def close(self)-> int:
+
+        self.flush()
+
+        logging.info(f"Total points flushed into InfluxDB: {self.points_flushed}.")
+
+        return self.points_flushed
+
+    ##
+    # Drop the pending points without writing them and return how many points were dropped
+    ##
+    def discard(self)-> int:
+
+        points_count:int = len(self.points)
+        self.points = []
+
+        if points_count > 0:
+            logging.warning(f"Discarded {points_count} points not written into InfluxDB.")
+
+        return points_count
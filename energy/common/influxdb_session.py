@@ -0,0 +1,107 @@
+##
+# Shared InfluxDB session for all the energy scripts.
+# A single client is created lazily the first time it is requested and reused by the whole process,
+# so the HTTP connections are kept alive and pooled instead of opening a new one on every query or write.
+# The configuration is read from the environment variables:
+# - INFLUXDB_HOST
+# - INFLUXDB_PORT
+# - INFLUXDB_DATABASE
+# - INFLUXDB_USER
+# - INFLUXDB_PASSWORD
+# - INFLUXDB_POOL_SIZE (optional, number of pooled connections, 10 by default)
+# - INFLUXDB_TIMEOUT (optional, seconds to wait for a response)
+# Queries and writes of the shared client are counted in the pipeline metrics.
+##
+import atexit
+import logging
+import math
+import os
+import threading
+from influxdb import InfluxDBClient
+from common import pipeline_metrics
+
+##
+# InfluxDB client that counts its queries, write requests and points written
+##
+class InstrumentedInfluxDBClient(InfluxDBClient):
+
+    def query(self, query, *args, **kwargs):
+        pipeline_metrics.increment("influxdb_queries")
+        return super().query(query, *args, **kwargs)
+
+    def write_points(self, points, *args, **kwargs):
+        points = list(points)
+        result = super().write_points(points, *args, **kwargs)
+
+        # Points are sent in one request or in one request by batch
+        batch_size = kwargs.get("batch_size")
+        pipeline_metrics.increment("influxdb_write_requests", math.ceil(len(points) / batch_size) if batch_size else 1)
+        pipeline_metrics.increment("points_written", len(points))
+
+        return result
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+##
+# Create a new InfluxDB client using the configuration of the environment variables
+##
+def create_influxdb_client()-> InfluxDBClient:
+
+    timeout = os.getenv("INFLUXDB_TIMEOUT")
+
+    return InstrumentedInfluxDBClient(
+        host=os.getenv("INFLUXDB_HOST"),
+        port=int(os.getenv("INFLUXDB_PORT")),
+        database=os.getenv("INFLUXDB_DATABASE"),
+        username=os.getenv("INFLUXDB_USER"),
+        password=os.getenv("INFLUXDB_PASSWORD"),
+        timeout=float(timeout) if timeout else None,
+        pool_size=int(os.getenv("INFLUXDB_POOL_SIZE", "10")),
+    )
+
+##
+# Get the InfluxDB client shared by the current process, creating it if needed.
+# Child processes never reuse the connections of the parent: a new client is created for every process.
+##
+def get_influxdb_client()-> InfluxDBClient:
+
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = create_influxdb_client()
+            _client_pid = os.getpid()
+            logging.debug("Shared InfluxDB client created.")
+
+        return _client
+
+##
+# Replace the InfluxDB client shared by the current process, for example with an in-memory stand-in
+##
+def set_influxdb_client(client):
+
+    global _client, _client_pid
+
+    with _client_lock:
+        _client = client
+        _client_pid = os.getpid()
+
+##
+# Close the InfluxDB client shared by the current process, if any
+##
+def close_influxdb_client():
+
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+            logging.debug("Shared InfluxDB client closed.")
+
+        _client = None
+        _client_pid = None
+
+# Release the connections when the process finishes
+atexit.register(close_influxdb_client)
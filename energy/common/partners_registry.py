@@ -0,0 +1,155 @@
+##
+# Compiled registry of the partners of the community and their supplies.
+# The partners JSON file is parsed only once and compiled into a compact form:
+# - cups: CUPS of every supply
+# - cups_index: position of every CUPS
+# - betas: array with the beta of every supply
+# - dnis: DNI of the partner of every supply
+# - partner_names and partner_dnis: name and DNI of every partner
+# - partner_offsets: the supplies of partner "i" are the ones between partner_offsets[i] and partner_offsets[i + 1]
+# The compiled registry is stored in a cache file next to the partners file, which is invalidated when the
+# partners file changes (checked by modification time and size, and then by content hash).
+##
+import hashlib
+import json
+import logging
+import os
+import pickle
+import numpy as np
+from common.atomic_files import open_atomic_file
+
+# Version of the format of the cache file. Increase it when the registry changes.
+CACHE_VERSION = 1
+
+class PartnersRegistry:
+
+    def __init__(self, partners:list):
+
+        self.partner_names:list = []
+        self.partner_dnis:list = []
+        self.cups:list = []
+        self.dnis:list = []
+        betas:list = []
+        partner_offsets:list = [0]
+
+        for partner in partners:
+            self.partner_names.append(partner.get("name"))
+            self.partner_dnis.append(partner.get("dni"))
+
+            for supply in partner["supplies"]:
+                self.cups.append(supply["cups"])
+                self.dnis.append(partner.get("dni"))
+                betas.append(supply["beta"])
+
+            partner_offsets.append(len(self.cups))
+
+        self.betas:np.ndarray = np.array(betas, dtype=np.float64)
+        self.partner_offsets:np.ndarray = np.array(partner_offsets, dtype=np.int64)
+        self.cups_index:dict = {cups: supply_index for supply_index, cups in enumerate(self.cups)}
+
+    ##
+    # Number of supplies of all the partners
+    ##
+    def __len__(self)-> int:
+        return len(self.cups)
+
+    ##
+    # Number of partners
+    ##
+    def partners_count(self)-> int:
+        return len(self.partner_names)
+
+    ##
+    # Indexes of the supplies of a partner
+    ##
+    def partner_supplies(self, partner_index:int)-> range:
+        return range(int(self.partner_offsets[partner_index]), int(self.partner_offsets[partner_index + 1]))
+
+##
+# Get the SHA-256 hash of the content of a file
+##
+def get_file_hash(file_path:str)-> str:
+
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(65536), b''):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+##
+# Get the path of the cache file of a partners file
+##
+def get_cache_file_path(partners_file_path:str)-> str:
+    return os.getenv("COMMUNITY_PARTNERS_CACHE_PATH") or f"{partners_file_path}.registry.cache"
+
+##
+# Read the cache file, returning None if it does not exist or it cannot be read
+##
+def read_cache(cache_file_path:str):
+
+    try:
+        with open(cache_file_path, 'rb') as cache_file:
+            cache:dict = pickle.load(cache_file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+
+    if not isinstance(cache, dict) or cache.get("version") != CACHE_VERSION:
+        return None
+
+    return cache
+
+##
+# Write the cache file. Errors are logged but not raised, the registry can always be compiled again.
+##
+def write_cache(cache_file_path:str, cache:dict):
+
+    try:
+        with open_atomic_file(cache_file_path) as cache_file:
+            pickle.dump(cache, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        logging.warning(f"Partners registry cache {cache_file_path} could not be written: {e}")
+
+_registries:dict = {}
+
+##
+# Get the compiled registry of a partners file, using the in-memory and on-disk caches when it did not change
+##
+def load_partners_registry(partners_file_path:str)-> PartnersRegistry:
+
+    file_stat = os.stat(partners_file_path)
+    file_signature:tuple = (file_stat.st_mtime_ns, file_stat.st_size)
+
+    # Registry already loaded by this process
+    loaded = _registries.get(partners_file_path)
+    if loaded is not None and loaded[0] == file_signature:
+        return loaded[1]
+
+    cache_file_path:str = get_cache_file_path(partners_file_path)
+    cache = read_cache(cache_file_path)
+
+    if cache is not None and (cache["mtime_ns"], cache["size"]) == file_signature:
+        registry:PartnersRegistry = cache["registry"]
+    else:
+        file_hash:str = get_file_hash(partners_file_path)
+
+        if cache is not None and cache["hash"] == file_hash:
+            # Same content with a different modification time
+            registry:PartnersRegistry = cache["registry"]
+        else:
+            logging.info(f"Compiling partners registry from {partners_file_path}.")
+
+            with open(partners_file_path, 'r') as partners_file:
+                registry:PartnersRegistry = PartnersRegistry(json.load(partners_file))
+
+        write_cache(cache_file_path, {
+            "version": CACHE_VERSION,
+            "mtime_ns": file_stat.st_mtime_ns,
+            "size": file_stat.st_size,
+            "hash": file_hash,
+            "registry": registry,
+        })
+
+    _registries[partners_file_path] = (file_signature, registry)
+
+    return registry
@@ -0,0 +1,181 @@
+##
+# Lightweight instrumentation of the energy scripts.
+# It records for the current process:
+# - the time spent in every stage of a script (downloads, InfluxDB reads, calculations, writes...)
+# - counters like HTTP requests, bytes downloaded, InfluxDB queries and points written
+# Stages can run at the same time in threads or worker processes, so every stage has two durations:
+# - seconds: wall-clock time during which at least one call of the stage was running
+# - worker_seconds: time of all the calls of the stage added together, greater than "seconds" when calls overlap
+# At the end of a run, a summary is written as JSON next to the log of the script and, if the
+# environment variable PIPELINE_METRICS_INFLUXDB is "true", as a point of the "pipeline_metrics" measurement.
+##
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import logging
+import os
+import threading
+import time
+import pytz
+
+_lock = threading.Lock()
+_stages:dict = {}
+_counters:dict = {}
+_start_time:float = time.monotonic()
+
+##
+# Forget all the recorded metrics and start measuring the run again
+##
+def reset_metrics():
+
+    global _start_time
+
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _start_time = time.monotonic()
+
+##
+# Measure the time spent in a stage. Stages can be measured many times, from many threads.
+##
+@contextmanager
+def stage(name:str):
+
+    # Time since the epoch, so the calls measured by different processes can be compared
+    stage_start_time:float = time.time()
+    try:
+        yield
+    finally:
+        add_stage_intervals(name, [(stage_start_time, time.time())])
+
+##
+# Add the intervals (start and end time since the epoch) of the calls of a stage
+##
+def add_stage_intervals(name:str, intervals:list):
+
+    with _lock:
+        stage_metrics:dict = _stages.setdefault(name, {"intervals": []})
+        stage_metrics["intervals"].extend((float(start), float(end)) for start, end in intervals)
+
+##
+# Get the durations of a stage from the intervals of its calls
+##
+def get_stage_durations(intervals:list)-> dict:
+
+    # Wall-clock time: overlapping intervals are counted once
+    seconds:float = 0.0
+    covered_until:float = None
+    for start, end in sorted(intervals):
+        if covered_until is None or start > covered_until:
+            seconds += end - start
+            covered_until = end
+        elif end > covered_until:
+            seconds += end - covered_until
+            covered_until = end
+
+    return {
+        "seconds": seconds,
+        "worker_seconds": sum(end - start for start, end in intervals),
+        "calls": len(intervals),
+    }
+
+##
+# Increase a counter
+##
+def increment(name:str, value=1):
+
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+##
+# Record an HTTP request and the bytes downloaded with it
+##
+def record_http_response(response):
+
+    increment("http_requests")
+    increment("bytes_downloaded", len(response.content or b""))
+
+##
+# Get a copy of the metrics recorded by the current process, with the intervals of the calls of every stage
+##
+def get_metrics()-> dict:
+
+    with _lock:
+        return {
+            "stages": {name: {"intervals": list(stage_metrics["intervals"])} for name, stage_metrics in _stages.items()},
+            "counters": dict(_counters),
+        }
+
+##
+# Add the metrics recorded by another process, for example a worker of a process pool
+##
+def merge_metrics(metrics:dict):
+
+    for name, stage_metrics in metrics["stages"].items():
+        add_stage_intervals(name, stage_metrics["intervals"])
+
+    for name, value in metrics["counters"].items():
+        increment(name, value)
+
+##
+# Build the summary of the run of a script
+##
+def get_run_summary(script_name:str)-> dict:
+
+    metrics:dict = get_metrics()
+
+    return {
+        "script": script_name,
+        "finished_at": datetime.now(pytz.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "total_seconds": time.monotonic() - _start_time,
+        "stages": {name: get_stage_durations(stage_metrics["intervals"]) for name, stage_metrics in metrics["stages"].items()},
+        "counters": metrics["counters"],
+    }
+
+##
+# Build the "pipeline_metrics" point with the summary of a run
+##
+def get_run_summary_point(summary:dict)-> dict:
+
+    fields:dict = {"total_seconds": float(summary["total_seconds"])}
+    for name, stage_metrics in summary["stages"].items():
+        fields[f"{name}_seconds"] = float(stage_metrics["seconds"])
+        fields[f"{name}_worker_seconds"] = float(stage_metrics["worker_seconds"])
+        fields[f"{name}_calls"] = int(stage_metrics["calls"])
+    for name, value in summary["counters"].items():
+        fields[name] = value
+
+    return {
+        "measurement": "pipeline_metrics",
+        "time": summary["finished_at"],
+        "fields": fields,
+        "tags": {
+            "script": summary["script"],
+        }
+    }
+
+##
+# Write the summary of the run of a script as JSON in a directory and, if enabled, into InfluxDB.
+# Errors are logged but not raised: metrics must never make a run fail.
+##
+def write_run_summary(script_name:str, directory:str)-> dict:
+
+    summary:dict = get_run_summary(script_name)
+
+    try:
+        with open(os.path.join(directory, f"{script_name}_metrics.json"), 'w') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+    except OSError as e:
+        logging.error(f"Error writing the run summary of {script_name}: {e}")
+
+    if os.getenv("PIPELINE_METRICS_INFLUXDB", "false").lower() == "true":
+        try:
+            # Imported here to avoid a circular import, the shared client is instrumented with this module
+            from common.influxdb_session import get_influxdb_client
+            get_influxdb_client().write_points([get_run_summary_point(summary)], time_precision='s')
+        except Exception as e:
+            logging.error(f"Error writing the run summary of {script_name} into InfluxDB: {e}")
+
+    logging.info(f"Run summary: {json.dumps(summary)}")
+
+    return summary
@@ -0,0 +1,122 @@
+##
+# Grid with the exact hours of a period of local days in the Europe/Madrid time zone.
+# Days are not always 24 hours long: the day of the change to summer time has 23 hours and the day
+# of the change to winter time has 25 hours. The grid is built once per period, it is memoized,
+# and it exposes every hour both in local time and in UTC, so callers can index hours by offset
+# instead of localizing datetimes again and again.
+##
+from datetime import datetime, timedelta
+from functools import lru_cache
+import numpy as np
+import pytz
+
+# Specify the time zone
+TIMEZONE = pytz.timezone('Europe/Madrid')
+
+class HourGrid:
+
+    def __init__(self, first_day:datetime, last_day:datetime):
+
+        # First and last local days of the period, without time zone
+        self.first_day:datetime = datetime(first_day.year, first_day.month, first_day.day)
+        self.last_day:datetime = datetime(last_day.year, last_day.month, last_day.day)
+
+        # Local days of the period
+        self.days:list = []
+        current_day:datetime = self.first_day
+        while current_day <= self.last_day:
+            self.days.append(current_day)
+            current_day += timedelta(days=1)
+
+        # Midnight of every local day converted to UTC, plus the midnight after the last day
+        day_starts:list = [TIMEZONE.localize(day).astimezone(pytz.utc) for day in self.days + [current_day]]
+
+        # First hour of the period and first hour after the period in UTC
+        self.utc_start:datetime = day_starts[0]
+        self.utc_end:datetime = day_starts[-1]
+
+        # Position of the first hour of every local day, plus the number of hours of the period
+        self.day_offsets:np.ndarray = np.array([int((day_start - self.utc_start).total_seconds()) // 3600 for day_start in day_starts], dtype=np.int64)
+
+        # Hours of the period in UTC and in local time
+        self.utc_hours:list = [self.utc_start + timedelta(hours=hour_offset) for hour_offset in range(int(self.day_offsets[-1]))]
+        self.local_hours:list = [utc_hour.astimezone(TIMEZONE) for utc_hour in self.utc_hours]
+
+        # Hours of the period in UTC as a NumPy array
+        self.utc_hours_array:np.ndarray = np.datetime64(self.utc_start.replace(tzinfo=None), 's') + np.arange(len(self.utc_hours), dtype=np.int64) * np.timedelta64(1, 'h')
+
+        # Hours of the period in RFC3339 format that InfluxDB can understand
+        self.influx_hours:list = [utc_hour.strftime("%Y-%m-%dT%H:%M:%SZ") for utc_hour in self.utc_hours]
+
+        # Local day of every hour (index in "days") and position of every hour in its local day (0 to 24)
+        hours_per_day:np.ndarray = np.diff(self.day_offsets)
+        self.hour_days:np.ndarray = np.repeat(np.arange(len(self.days), dtype=np.int64), hours_per_day)
+        self.hour_positions:np.ndarray = np.arange(len(self.utc_hours), dtype=np.int64) - self.day_offsets[self.hour_days]
+
+    ##
+    # Number of hours of the period
+    ##
+    def __len__(self)-> int:
+        return len(self.utc_hours)
+
+    ##
+    # Number of hours of every local day: 23, 24 or 25
+    ##
+    def hours_per_day(self)-> np.ndarray:
+        return np.diff(self.day_offsets)
+
+    ##
+    # Positions of the hours of a local day, given its index in "days"
+    ##
+    def day_hours(self, day_index:int)-> range:
+        return range(int(self.day_offsets[day_index]), int(self.day_offsets[day_index + 1]))
+
+##
+# Get the grid of hours of the local days between two days, both included
+##
+@lru_cache(maxsize=64)
+def get_hour_grid(first_day:datetime, last_day:datetime)-> HourGrid:
+    return HourGrid(first_day, last_day)
+
+##
+# Get the last day of the month of a day
+##
+def get_month_last_day(day:datetime)-> datetime:
+
+    # Determine the last day of the month
+    if day.month == 12:
+        return datetime(day.year + 1, 1, 1) - timedelta(days=1)
+
+    return datetime(day.year, day.month + 1, 1) - timedelta(days=1)
+
+##
+# Get the first day of the month after the month of a day
+##
+def get_next_month(day:datetime)-> datetime:
+
+    if day.month == 12:
+        return datetime(day.year + 1, 1, 1)
+
+    return datetime(day.year, day.month + 1, 1)
+
+##
+# Get the first day of every month between two months, both included
+##
+def get_months(first_month:datetime, last_month:datetime)-> list:
+
+    months:list = []
+    current_month:datetime = datetime(first_month.year, first_month.month, 1)
+    while current_month <= last_month:
+        months.append(current_month)
+        current_month = get_next_month(current_month)
+
+    return months
+
+##
+# Get the grid of hours of a month
+##
+def get_month_hour_grid(year:int, month:int)-> HourGrid:
+
+    first_day:datetime = datetime(year, month, 1)
+
+    return get_hour_grid(first_day, get_month_last_day(first_day))
@@ -0,0 +1,253 @@
+##
+# Exports the hourly energy data of all the community supplies ("community_supply" measurement)
+# for a month or a whole year into a Parquet file with typed columns (or a CSV file, optionally compressed):
+# - time (UTC)
+# - CUPS (dictionary encoded)
+# - beta
+# - production, surplus, final consumption, self consumption, compensation
+# - self consumption percentage and utilization percentage
+# Data is fetched and written month by month, every month is a row group of the Parquet file,
+# so memory does not depend on the length of the period.
+##
+from datetime import datetime
+import argparse
+import logging
+import os
+import sys
+import numpy as np
+from dotenv import load_dotenv
+
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import pipeline_metrics
+from common.influxdb_session import get_influxdb_client
+from common.time_grid import HourGrid, get_month_hour_grid
+import report_files
+from report_files import CSV_COMPRESSIONS, REPORT_FORMATS, ParquetReportWriter, check_compression_available, check_parquet_available, write_csv_report
+
+# Load environment variables from the .env file in the current directory
+load_dotenv()
+
+# Get the absolute path of the currently executing script
+script_path = os.path.abspath(__file__)
+
+# Get the directory containing the script
+script_directory = os.path.dirname(script_path)
+
+# Get the base name of the script (without extension)
+script_name = os.path.splitext(os.path.basename(script_path))[0]
+
+# Logging configuration
+log_file_path = f"{script_directory}/logs/{script_name}.log"
+log_format = "%(asctime)s - %(levelname)s - %(message)s"
+logging.basicConfig(filename=log_file_path, encoding='utf-8', level=logging.INFO, format=log_format)
+
+# Fields of the "community_supply" measurement exported
+EXPORT_FIELDS:tuple = ("production", "surplus", "consumption_final", "self_consumption", "self_consumption_percentage", "utilization_percentage", "compensation")
+
+# Header of the CSV file
+EXPORT_HEADER:list = ["time", "cups", "beta"] + list(EXPORT_FIELDS)
+
+##
+# Get current script name
+##
+def get_script_name()-> str:
+    # Get the absolute path of the currently executing script
+    script_path = os.path.abspath(__file__)
+
+    # Get the base name of the script (without extension)
+    return os.path.splitext(os.path.basename(script_path))[0]
+
+##
+# Get the arguments of the script:
+# - period: year with format YYYY or month with format YYYY-mm
+# - format: format of the file, "parquet" or "csv"
+# - compression: compression of the CSV file, "none", "gzip" or "zstd"
+##
+def get_arguments()-> argparse.Namespace:
+
+    # Function to validate the period format
+    def validate_period(period_str):
+        for period_format in ("%Y-%m", "%Y"):
+            try:
+                datetime.strptime(period_str, period_format)
+                return period_str
+            except ValueError:
+                pass
+        raise argparse.ArgumentTypeError(f"Period {period_str} has an invalid format. Use yyyy or yyyy-mm.")
+
+    # Create an ArgumentParser object
+    parser = argparse.ArgumentParser(description='Script to export the hourly data of all the community supplies into a Parquet file')
+
+    # Define the expected arguments
+    parser.add_argument('period', type=validate_period, help='Year in "yyyy" format or year and month in "yyyy-mm" format')
+    parser.add_argument('--format', choices=REPORT_FORMATS, default='parquet', help='Format of the file')
+    parser.add_argument('--compression', choices=list(CSV_COMPRESSIONS), default='none', help='Compression of the CSV file')
+
+    # Parse the command-line arguments
+    args = parser.parse_args()
+
+    # Parquet files are always compressed with zstd, the compression only applies to CSV files
+    if args.format == 'parquet' and args.compression != 'none':
+        parser.error(f"Compression {args.compression} can only be used with the csv format.")
+
+    return args
+
+##
+# Get the first day of every month of a period with format YYYY or YYYY-mm
+##
+def get_period_months(period:str)-> list:
+
+    if len(period) == 4:
+        return [datetime(int(period), month, 1) for month in range(1, 13)]
+
+    return [datetime.strptime(period, "%Y-%m")]
+
+##
+# Transform a datetime into a date in RFC3339 format that InfluxDB can understand
+##
+def get_influx_date(month_date:datetime)-> str:
+
+    # Format the datetime object as an InfluxDB-compatible timestamp string (RFC3339 format)
+    return month_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+##
+# Get the schema of the exported file
+##
+def get_export_schema():
+
+    check_parquet_available()
+
+    pa = report_files.pa
+
+    return pa.schema(
+        [
+            ("time", pa.timestamp("ms", tz="UTC")),
+            ("cups", pa.dictionary(pa.int32(), pa.string())),
+            ("beta", pa.float64()),
+        ]
+        + [(field, pa.float64()) for field in EXPORT_FIELDS]
+    )
+
+##
+# Get the hourly data of all the supplies for the hours of a grid with a single query grouped by CUPS and beta.
+# Returns a map of columns: time, CUPS, beta and every exported field
+##
+def get_supplies_hourly_data(hour_grid:HourGrid)-> dict:
+
+    try:
+        client = get_influxdb_client()
+
+        fields:str = ", ".join(f'"{field}"' for field in EXPORT_FIELDS)
+        query:str = f'SELECT {fields} FROM "community_supply" WHERE time >= \'{get_influx_date(hour_grid.utc_start)}\' AND time < \'{get_influx_date(hour_grid.utc_end)}\' GROUP BY "cups", "beta"'
+        with pipeline_metrics.stage("influxdb_read"):
+            result = client.query(query)
+
+        columns:dict = {"time": [], "cups": [], "beta": []}
+        for field in EXPORT_FIELDS:
+            columns[field] = []
+
+        for (measurement, tags), points in result.items():
+            for point in points:
+                columns["time"].append(point["time"].rstrip("Z"))
+                columns["cups"].append(tags["cups"])
+                columns["beta"].append(float(tags["beta"]))
+                for field in EXPORT_FIELDS:
+                    value = point[field]
+                    columns[field].append(float(value) if value is not None else np.nan)
+
+        return columns
+
+    except Exception as e:
+        logging.error(f"Error getting the hourly data of the supplies from {hour_grid.utc_start} to {hour_grid.utc_end}: {e}")
+        raise e
+
+##
+# Build the table of a month with the schema of the exported file
+##
+def get_supplies_hourly_table(columns:dict, schema):
+
+    pa = report_files.pa
+
+    arrays:list = [
+        pa.array(np.array(columns["time"], dtype="datetime64[s]")).cast(schema.field("time").type),
+        report_files.get_dictionary_column(columns["cups"]),
+        pa.array(columns["beta"], type=pa.float64()),
+    ]
+    arrays.extend(report_files.get_nullable_floats(columns[field]) for field in EXPORT_FIELDS)
+
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+##
+# Generate the rows of the CSV file of a period, fetching the data month by month
+##
+def get_supplies_hourly_rows(months:list):
+
+    for month_first_day in months:
+
+        # Exact hours of the month, taking into account the changes of time
+        hour_grid:HourGrid = get_month_hour_grid(month_first_day.year, month_first_day.month)
+
+        columns:dict = get_supplies_hourly_data(hour_grid)
+
+        for row_index in range(len(columns["time"])):
+            yield [f"{columns['time'][row_index]}Z"] + [columns[name][row_index] for name in EXPORT_HEADER[1:]]
+
+        logging.info(f"Month {month_first_day.strftime('%Y-%m')} exported: {len(columns['time'])} rows.")
+
+##
+# Export a period into a Parquet file, one row group by month
+##
+def export_parquet(file_name:str, months:list)-> int:
+
+    schema = get_export_schema()
+
+    with ParquetReportWriter(file_name, schema) as writer:
+        for month_first_day in months:
+
+            # Exact hours of the month, taking into account the changes of time
+            hour_grid:HourGrid = get_month_hour_grid(month_first_day.year, month_first_day.month)
+
+            columns:dict = get_supplies_hourly_data(hour_grid)
+
+            with pipeline_metrics.stage("file_write"):
+                writer.write(get_supplies_hourly_table(columns, schema))
+
+            logging.info(f"Month {month_first_day.strftime('%Y-%m')} exported: {len(columns['time'])} rows.")
+
+    return writer.rows_written
+
+##
+# Main function
+##
+def main():
+
+    script_name = get_script_name()
+
+    logging.info(f"Process {script_name} started.")
+
+    try:
+
+        args:argparse.Namespace = get_arguments()
+
+        months:list = get_period_months(args.period)
+
+        if args.format == "parquet":
+            file_name = f"energy/community/data/supplies_hourly_{args.period}.parquet"
+            rows_written:int = export_parquet(file_name, months)
+        else:
+            check_compression_available(args.compression)
+            file_name = f"energy/community/data/supplies_hourly_{args.period}.csv{CSV_COMPRESSIONS[args.compression]}"
+            rows_written:int = write_csv_report(file_name, EXPORT_HEADER, get_supplies_hourly_rows(months), args.compression)
+
+        logging.info(f"Rows exported into {file_name}: {rows_written}.")
+
+    except Exception as e:
+        logging.error(f"Error: {e}")
+
+    pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
+
+    logging.info(f"Process {script_name} finished.")
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,36 @@
 ##
-# Generates a report with all the surplus values hourly for all the days of a month
-#
-from datetime import datetime, timedelta
-import json
-import csv
+# Generates a report with all the surplus values hourly for all the days of a month.
+# The surplus of the whole community is fetched with a single query and pivoted into a matrix
+# of days x hours (HOR1 to HOR25, the 25th hour is only used on the day of the change to winter time)
+##
+from datetime import datetime
 import argparse
-from influxdb import InfluxDBClient
 import logging
 import os
+import sys
+import numpy as np
 from dotenv import load_dotenv
 
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import pipeline_metrics
+from common.influxdb_session import get_influxdb_client
+from common.time_grid import HourGrid, get_month_hour_grid
+from report_cache import get_cache_key, get_data_fingerprint, restore_cached_report, store_cached_report
+from report_files import REPORT_FORMATS, check_parquet_available, get_dictionary_column, get_nullable_floats, get_report_table, write_csv_report, write_parquet_report
+
 # Load environment variables from the .env file in the current directory
 load_dotenv()
 
-INFLUXDB_HOST = os.getenv("INFLUXDB_HOST")
-INFLUXDB_PORT = int(os.getenv("INFLUXDB_PORT"))
-INFLUXDB_DATABASE = os.getenv("INFLUXDB_DATABASE")
-INFLUXDB_USER = os.getenv("INFLUXDB_USER")
-INFLUXDB_PASSWORD = os.getenv("INFLUXDB_PASSWORD")
+CIL = os.getenv("CIL")
+MEASUREMENT_TYPE = os.getenv("MEASUREMENT_TYPE")
+STATUS = os.getenv("STATUS")
 
-COMMUNITY_PARTNERS_FILE_PATH=os.getenv("COMMUNITY_PARTNERS_FILE_PATH")
+# Maximum number of hours of a day, reached on the day of the change to winter time
+MAX_DAY_HOURS = 25
 
-CIL = os.getenv("INFLUXDB_PASSWORD")
-MEASUREMENT_TYPE = os.getenv("INFLUXDB_PASSWORD")
-STATUS = os.getenv("INFLUXDB_PASSWORD")
+# Header of the CSV report
+REPORT_HEADER:list = ["CIL", "Tipo de medida (AS/RC/RI)", "Estado (R/E)", "FECHA (dd/mm/aaaa)"] + [f"HOR{hour}" for hour in range(1, MAX_DAY_HOURS + 1)]
 
 # Get the absolute path of the currently executing script
 script_path = os.path.abspath(__file__)
@@ -49,16 +56,13 @@ def get_script_name()-> str:
     # Get the base name of the script (without extension)
     return os.path.splitext(os.path.basename(script_path))[0]
 
-def create_influxdb_client():
-    return InfluxDBClient(host=INFLUXDB_HOST, port=INFLUXDB_PORT, database=INFLUXDB_DATABASE, username=INFLUXDB_USER, password=INFLUXDB_PASSWORD)
-
-def close_influxdb_client(client:InfluxDBClient):
-    client.close()
-
 ##
-# Get the month passed by argument with format YYYY-mm
+# Get the arguments of the script:
+# - month: month of the report with format YYYY-mm
+# - format: format of the report file, "csv" or "parquet"
+# - force: generate the report even if it is found in the cache
 ##
-def get_month_first_day()-> datetime:
+def get_arguments()-> argparse.Namespace:
 
     # Function to validate the date format 
     def validate_date(date_str):
@@ -72,25 +76,11 @@ def get_month_first_day()-> datetime:
 
     # Define the expected arguments
     parser.add_argument('month', type=validate_date, help='Year and month in "yyyy-mm" format')
+    parser.add_argument('--format', choices=REPORT_FORMATS, default='csv', help='Format of the report file')
+    parser.add_argument('--force', action='store_true', help='Generate the report even if it is found in the cache')
 
     # Parse the command-line arguments
-    args = parser.parse_args()
-
-    return args.month
-
-def get_month_last_day(month_first_day:datetime)-> datetime:
-
-    # Iterate by every day of the month
-    month:int = month_first_day.month
-    year:int = month_first_day.year
-    
-    # Determine the last day of the month
-    if month == 12:
-        last_day:datetime = datetime(year + 1, 1, 1) - timedelta(days=1)
-    else:
-        last_day:datetime = datetime(year, month + 1, 1) - timedelta(days=1)
-
-    return last_day
+    return parser.parse_args()
 
 ##
 # Transform a datetime into a date in RFC3339 format that InfluxDB can understand
@@ -101,49 +91,70 @@ def get_influx_date(month_date:datetime)-> str:
     return month_date.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 ##
-# Transform the result of a query to a InfluxDB into a float value
-# If there is an error during the transformation, returns a 0.0
+# Get the surplus of the whole community for every hour of a grid with a single query.
+# Returns an array with the surplus by hour, hours without data get 0.0
 ##
-def get_value_as_float(result, field:str)-> float:
+def get_community_surplus_by_hour(hour_grid:HourGrid)-> np.ndarray:
 
     try:
-        # If nothing is found, return zero
-        if len(result.keys()) == 0:
-            return 0.0
-        
-        # Access the measurement name (it's the first key in the ResultSet)
-        measurement = list(result.keys())[0]
-
-        # Access the data points for that measurement
-        data_points = result[measurement]
-
-        # Iterate through the data points
-        for point in data_points:
-            value = point[field]            
-            return value
-        
+        client = get_influxdb_client()
+
+        query:str = f'SELECT SUM("surplus") AS "surplus" FROM "community_supply" WHERE time >= \'{get_influx_date(hour_grid.utc_start)}\' AND time < \'{get_influx_date(hour_grid.utc_end)}\' GROUP BY time(1h)'
+        with pipeline_metrics.stage("influxdb_read"):
+            result = client.query(query)
+
+        surplus_by_time:dict = {point["time"]: point["surplus"] for point in result.get_points()}
+
+        return np.array([surplus_by_time.get(hour) or 0.0 for hour in hour_grid.influx_hours], dtype=np.float64)
+
     except Exception as e:
-        logging.error(f"Error extracting the value {field} as float from an InfluxDB query result.", e)
+        logging.error(f"Error getting the community surplus from {hour_grid.utc_start} to {hour_grid.utc_end}: {e}")
         raise e
-    
+
 ##
-# Get aggreagate production by CUPS for a given month
+# Pivot the values by hour of a grid into a matrix of days x 25 hours.
+# Every day fills as many hours as it has: 23 on the change to summer time, 24 on normal days
+# and 25 on the change to winter time. Hours that a day does not have are NaN
 ##
-def get_sum_value_by_interval(field:str, first_day:datetime, last_day:datetime)-> float:
+def get_day_hour_matrix(hour_grid:HourGrid, values:np.ndarray)-> np.ndarray:
 
-    try:
-        client = create_influxdb_client()
+    matrix:np.ndarray = np.full((len(hour_grid.days), MAX_DAY_HOURS), np.nan, dtype=np.float64)
+    matrix[hour_grid.hour_days, hour_grid.hour_positions] = values
 
-        query:str = f'SELECT SUM("{field}") AS "{field}" FROM "community_supply" WHERE "cups" = \'{cups}\' and time >= \'{get_influx_date(first_day)}\' AND time <= \'{get_influx_date(last_day)}\''
-        result = client.query(query)
+    return matrix
 
-        close_influxdb_client(client)
-            
-        return get_value_as_float(result, field)
-    
-    except Exception as e:
-        logging.error(f"Error getting aggreagate production by cups {cups} for month {first_day}.", e)
-        raise e
+##
+# Build the rows of the report, one by day, from the matrix of days x 25 hours
+##
+def get_compensation_report_rows(hour_grid:HourGrid, matrix:np.ndarray):
+
+    for day_index, day in enumerate(hour_grid.days):
+
+        row:list = [CIL, MEASUREMENT_TYPE, STATUS, day.strftime("%d/%m/%Y")]
+
+        # Hours that the day does not have are left empty
+        row.extend("" if np.isnan(value) else float(value) for value in matrix[day_index])
+
+        yield row
+
+##
+# Build the typed table of the report from the matrix of days x 25 hours, one row by day.
+# Hours that a day does not have are missing values
+##
+def get_compensation_report_table(hour_grid:HourGrid, matrix:np.ndarray):
+
+    days_count:int = len(hour_grid.days)
+
+    columns:dict = {
+        "cil": get_dictionary_column([CIL] * days_count),
+        "measurement_type": get_dictionary_column([MEASUREMENT_TYPE] * days_count),
+        "status": get_dictionary_column([STATUS] * days_count),
+        "date": [day.date() for day in hour_grid.days],
+    }
+    for hour_index in range(MAX_DAY_HOURS):
+        columns[f"hor{hour_index + 1}"] = get_nullable_floats(matrix[:, hour_index])
+
+    return get_report_table(columns)
 
 ##
 # Main function
@@ -156,105 +167,44 @@ def main():
 
     try:
 
-         # Open the JSON file for reading with all the partners with all their supplies
-        with open(COMMUNITY_PARTNERS_FILE_PATH, 'r') as partners_file:
-            partners = json.load(partners_file)
+        args:argparse.Namespace = get_arguments()
+        month_first_day:datetime = args.month
+
+        if args.format == "parquet":
+            check_parquet_available()
+
+        # Exact hours of the month, taking into account the changes of time
+        hour_grid:HourGrid = get_month_hour_grid(month_first_day.year, month_first_day.month)
 
-        month_first_day:datetime = get_month_first_day()
-        month_last_day:datetime = get_month_last_day(month_first_day)
-        
         # File name
-        csv_file_name = f"energy/community/data/supplies_report_{month_first_day.strftime('%Y-%m')}.csv"
-
-        # Open the CSV file in write mode
-        # We use newline='' to ensure consistent line endings on all platforms
-        with open(csv_file_name, mode='w', newline='') as file:
-            # Create a CSV writer object
-            writer = csv.writer(file, delimiter=';')
-
-            # Write header
-            header = [
-                "CIL",
-                "Tipo de medida (AS/RC/RI)",
-                "Estado (R/E)",
-                "FECHA (dd/mm/aaaa)",
-                "HOR1",
-                "HOR2",
-                "HOR3",
-                "HOR4",
-                "HOR5",
-                "HOR6",
-                "HOR7",
-                "HOR8",
-                "HOR9",
-                "HOR10",
-                "HOR11",
-                "HOR12",
-                "HOR13",
-                "HOR14",
-                "HOR15",
-                "HOR16",
-                "HOR17",
-                "HOR18",
-                "HOR19",
-                "HOR20",
-                "HOR21",
-                "HOR22",
-                "HOR23",
-                "HOR24",
-                "HOR25"
-                ]
-            writer.writerow(header)
-
-            # Iterate through the days of the month
-            current_day:datetime = month_first_day
-            while current_day <= month_last_day:
-
-                row = [CIL, MEASUREMENT_TYPE, STATUS, current_day.strftime("dd/mm/YYYY")]
-
-                logging.info(f"Day: {current_day}.")
-            
-                # Iterate by every hour of the day from 0 to 23
-                for current_hour in range(24):
-
-                    logging.info(f"Hour: {current_hour}.")
-
-                    # Loop the list of partners
-                    for partner in partners:
-                        supplies = partner["supplies"]
-                        
-                        # Loop the list of supplies by partner
-                        for supply in supplies:
-
-                            cups = supply["cups"]
-                            beta = supply["beta"]
-
-                            # Get supply final consumption
-                            consumption_final = get_sum_value_by_interval("consumption_final", cups, month_first_day, month_last_day)
-
-                            # Get supply surplus
-                            surplus = get_sum_value_by_interval("surplus", cups, month_first_day, month_last_day)
-
-                            # Get supply self consumption
-                            self_consumption = get_sum_value_by_interval("self_consumption", cups, month_first_day, month_last_day)
-
-                            # Calculate supply self consumption percentage
-                            self_consumption_percentage:float = 0.0
-                            if (self_consumption + consumption_final) > 0.0:
-                                self_consumption_percentage = self_consumption / (self_consumption + consumption_final)
-
-                            # Calculate utilization percentage
-                            utilization_percentage:float = 0.0
-                            if (self_consumption + surplus) > 0.0 :
-                                utilization_percentage = self_consumption / (self_consumption + surplus)
-
-                            row =  [cups, beta, consumption_final, surplus, self_consumption, self_consumption_percentage, utilization_percentage]
-
-                            writer.writerow(row)
+        file_name = f"energy/community/data/compensation_report_{month_first_day.strftime('%Y-%m')}.{args.format}"
+
+        # Key of the report in the cache, it changes when the installation codes or the data of the month change
+        cache_key:str = get_cache_key("compensation_report", month_first_day.strftime('%Y-%m'), {
+            "format": args.format,
+            "codes": [CIL, MEASUREMENT_TYPE, STATUS],
+            "data": get_data_fingerprint(hour_grid.utc_start, hour_grid.utc_end),
+        })
+
+        if not args.force and restore_cached_report(cache_key, file_name):
+            logging.info("Inputs of the report not changed since a previous run.")
+        else:
+            # Get the surplus of every hour of the month and arrange it by day and hour
+            matrix:np.ndarray = get_day_hour_matrix(hour_grid, get_community_surplus_by_hour(hour_grid))
+
+            if args.format == "parquet":
+                write_parquet_report(file_name, get_compensation_report_table(hour_grid, matrix))
+            else:
+                # Write one row by day
+                write_csv_report(file_name, REPORT_HEADER, get_compensation_report_rows(hour_grid, matrix))
+
+            store_cached_report(cache_key, file_name)
 
     except Exception as e:
         logging.error("Error:", e)    
 
+    pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
+
     logging.info(f"Process {script_name} finished.")
 
 if __name__ == "__main__":
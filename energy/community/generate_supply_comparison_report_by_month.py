@@ -0,0 +1,284 @@
+##
+# Generates a report that compares for each community supply the self consumption percentage and the
+# utilization percentage of a month with:
+# - the previous month
+# - the same month of the previous year
+# It includes the differences between the periods and the ranking of every supply in the community.
+# The three periods are fetched with a single query and all the supplies are compared at once.
+##
+from datetime import datetime
+import argparse
+import logging
+import os
+import sys
+import numpy as np
+from dotenv import load_dotenv
+
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Get the absolute path of the currently executing script
+script_path = os.path.abspath(__file__)
+
+# Get the directory containing the script
+script_directory = os.path.dirname(script_path)
+
+# Get the base name of the script (without extension)
+script_name = os.path.splitext(os.path.basename(script_path))[0]
+
+# Logging configuration, before the supply report is imported so this script logs into its own file
+log_file_path = f"{script_directory}/logs/{script_name}.log"
+log_format = "%(asctime)s - %(levelname)s - %(message)s"
+logging.basicConfig(filename=log_file_path, encoding='utf-8', level=logging.INFO, format=log_format)
+
+from common import pipeline_metrics
+from common.partners_registry import PartnersRegistry, load_partners_registry
+from common.time_grid import get_month_hour_grid
+from generate_supply_report_by_month import REPORT_FIELDS, get_supplies_values_by_intervals
+from report_files import REPORT_FORMATS, check_parquet_available, get_dictionary_column, get_nullable_floats, get_nullable_integers, get_report_table, write_csv_report, write_parquet_report
+from supplies_metrics import get_self_consumption_percentage, get_utilization_percentage
+
+# Load environment variables from the .env file in the current directory
+load_dotenv()
+
+COMMUNITY_PARTNERS_FILE_PATH=os.getenv("COMMUNITY_PARTNERS_FILE_PATH")
+
+# Header of the CSV report and names of the columns of the Parquet report
+REPORT_HEADER:list = [
+    "CUPS",
+    "COEF REP",
+    "% AUTOCON",
+    "% AUTOCON MES ANTERIOR",
+    "DIF % AUTOCON MES ANTERIOR",
+    "% AUTOCON AÑO ANTERIOR",
+    "DIF % AUTOCON AÑO ANTERIOR",
+    "% APROVECHAMIENTO",
+    "% APROVECHAMIENTO MES ANTERIOR",
+    "DIF % APROVECHAMIENTO MES ANTERIOR",
+    "% APROVECHAMIENTO AÑO ANTERIOR",
+    "DIF % APROVECHAMIENTO AÑO ANTERIOR",
+    "RANKING % AUTOCON",
+    "RANKING % APROVECHAMIENTO",
+    "RANKING DIF % AUTOCON MES ANTERIOR",
+]
+REPORT_COLUMNS:list = [
+    "cups",
+    "beta",
+    "self_consumption_percentage",
+    "self_consumption_percentage_previous_month",
+    "self_consumption_percentage_previous_month_delta",
+    "self_consumption_percentage_previous_year",
+    "self_consumption_percentage_previous_year_delta",
+    "utilization_percentage",
+    "utilization_percentage_previous_month",
+    "utilization_percentage_previous_month_delta",
+    "utilization_percentage_previous_year",
+    "utilization_percentage_previous_year_delta",
+    "self_consumption_percentage_rank",
+    "utilization_percentage_rank",
+    "self_consumption_percentage_previous_month_delta_rank",
+]
+
+##
+# Get current script name
+##
+def get_script_name()-> str:
+    # Get the absolute path of the currently executing script
+    script_path = os.path.abspath(__file__)
+
+    # Get the base name of the script (without extension)
+    return os.path.splitext(os.path.basename(script_path))[0]
+
+##
+# Get the arguments of the script:
+# - month: month of the report with format YYYY-mm
+# - format: format of the report file, "csv" or "parquet"
+##
+def get_arguments()-> argparse.Namespace:
+
+    # Function to validate the date format
+    def validate_date(date_str):
+        try:
+            return datetime.strptime(date_str, "%Y-%m")
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Date {date_str} has an invalid format. Use yyyy-mm.")
+
+    # Create an ArgumentParser object
+    parser = argparse.ArgumentParser(description='Script to compare the percentages of the supplies of a month with the previous month and the previous year')
+
+    # Define the expected arguments
+    parser.add_argument('month', type=validate_date, help='Year and month in "yyyy-mm" format')
+    parser.add_argument('--format', choices=REPORT_FORMATS, default='csv', help='Format of the report file')
+
+    # Parse the command-line arguments
+    return parser.parse_args()
+
+##
+# Get the first day of the months compared: the month, the previous month and the same month of the previous year
+##
+def get_compared_months(month_first_day:datetime)-> list:
+
+    if month_first_day.month == 1:
+        previous_month:datetime = datetime(month_first_day.year - 1, 12, 1)
+    else:
+        previous_month:datetime = datetime(month_first_day.year, month_first_day.month - 1, 1)
+
+    return [month_first_day, previous_month, datetime(month_first_day.year - 1, month_first_day.month, 1)]
+
+##
+# Get the values of every report field of all the supplies for every compared month.
+# The compared months are fetched in a single request with one statement by month,
+# from the monthly rollup if it has the compared months.
+# Returns a map by field with a matrix (months x supplies), months without data for a supply are NaN
+##
+def get_compared_values(partners_registry:PartnersRegistry, months:list)-> dict:
+
+    # Exact hours of every compared month, taking into account the changes of time
+    hour_grids:list = [get_month_hour_grid(month_first_day.year, month_first_day.month) for month_first_day in months]
+    intervals:list = [(hour_grid.utc_start, hour_grid.utc_end) for hour_grid in hour_grids]
+
+    month_keys:list = [month_first_day.strftime('%Y-%m') for month_first_day in months]
+
+    monthly_values:dict = get_supplies_values_by_intervals(intervals, "community_supply_monthly")
+    if not set(month_keys).issubset(monthly_values):
+        logging.info("Monthly rollup not available for all the compared months, adding up the hourly data.")
+        monthly_values = get_supplies_values_by_intervals(intervals)
+
+    compared_values:dict = {field: np.full((len(months), len(partners_registry)), np.nan, dtype=np.float64) for field in REPORT_FIELDS}
+    for month_index, month_key in enumerate(month_keys):
+        for cups, values in monthly_values.get(month_key, {}).items():
+            supply_index = partners_registry.cups_index.get(cups)
+            if supply_index is None:
+                continue
+            for field in REPORT_FIELDS:
+                compared_values[field][month_index, supply_index] = values[field]
+
+    return compared_values
+
+##
+# Get the rank of every value, 1 for the greatest one. NaN values are not ranked
+##
+def get_ranks(values:np.ndarray)-> np.ndarray:
+
+    ranks:np.ndarray = np.full(values.shape, np.nan, dtype=np.float64)
+
+    valid:np.ndarray = ~np.isnan(values)
+    order:np.ndarray = np.argsort(-values[valid], kind="stable")
+
+    valid_ranks:np.ndarray = np.empty(len(order), dtype=np.float64)
+    valid_ranks[order] = np.arange(1, len(order) + 1)
+    ranks[valid] = valid_ranks
+
+    return ranks
+
+##
+# Compare the percentages of all the supplies between the months, all the supplies at once.
+# Returns a map by column of the report with an array of values by supply
+##
+def get_comparison_columns(partners_registry:PartnersRegistry, compared_values:dict)-> dict:
+
+    with pipeline_metrics.stage("calculation"):
+
+        # Percentages by month and supply, with the same formulas as the monthly supply report
+        self_consumption_percentage:np.ndarray = get_self_consumption_percentage(compared_values["self_consumption"], compared_values["consumption_final"])
+        utilization_percentage:np.ndarray = get_utilization_percentage(compared_values["self_consumption"], compared_values["surplus"])
+
+        # Months without data have no percentage
+        missing:np.ndarray = np.isnan(compared_values["self_consumption"])
+        self_consumption_percentage[missing] = np.nan
+        utilization_percentage[missing] = np.nan
+
+        columns:dict = {
+            "cups": partners_registry.cups,
+            "beta": partners_registry.betas,
+            "self_consumption_percentage": self_consumption_percentage[0],
+            "self_consumption_percentage_previous_month": self_consumption_percentage[1],
+            "self_consumption_percentage_previous_month_delta": self_consumption_percentage[0] - self_consumption_percentage[1],
+            "self_consumption_percentage_previous_year": self_consumption_percentage[2],
+            "self_consumption_percentage_previous_year_delta": self_consumption_percentage[0] - self_consumption_percentage[2],
+            "utilization_percentage": utilization_percentage[0],
+            "utilization_percentage_previous_month": utilization_percentage[1],
+            "utilization_percentage_previous_month_delta": utilization_percentage[0] - utilization_percentage[1],
+            "utilization_percentage_previous_year": utilization_percentage[2],
+            "utilization_percentage_previous_year_delta": utilization_percentage[0] - utilization_percentage[2],
+        }
+        columns["self_consumption_percentage_rank"] = get_ranks(columns["self_consumption_percentage"])
+        columns["utilization_percentage_rank"] = get_ranks(columns["utilization_percentage"])
+        columns["self_consumption_percentage_previous_month_delta_rank"] = get_ranks(columns["self_consumption_percentage_previous_month_delta"])
+
+    return columns
+
+##
+# Build the rows of the CSV report, values that cannot be compared are left empty
+##
+def get_comparison_report_rows(columns:dict):
+
+    for supply_index, cups in enumerate(columns["cups"]):
+
+        row:list = [cups, float(columns["beta"][supply_index])]
+        for name in REPORT_COLUMNS[2:]:
+            value = columns[name][supply_index]
+            if np.isnan(value):
+                row.append("")
+            elif name.endswith("_rank"):
+                row.append(int(value))
+            else:
+                row.append(float(value))
+
+        yield row
+
+##
+# Build the typed table of the report, values that cannot be compared are missing values
+##
+def get_comparison_report_table(columns:dict):
+
+    table_columns:dict = {
+        "cups": get_dictionary_column(columns["cups"]),
+        "beta": columns["beta"],
+    }
+    for name in REPORT_COLUMNS[2:]:
+        table_columns[name] = get_nullable_integers(columns[name]) if name.endswith("_rank") else get_nullable_floats(columns[name])
+
+    return get_report_table(table_columns)
+
+##
+# Main function
+##
+def main():
+
+    script_name = get_script_name()
+
+    logging.info(f"Process {script_name} started.")
+
+    try:
+
+        # Registry with all the partners with all their supplies
+        partners_registry:PartnersRegistry = load_partners_registry(COMMUNITY_PARTNERS_FILE_PATH)
+
+        args:argparse.Namespace = get_arguments()
+        month_first_day:datetime = args.month
+
+        if args.format == "parquet":
+            check_parquet_available()
+
+        months:list = get_compared_months(month_first_day)
+
+        columns:dict = get_comparison_columns(partners_registry, get_compared_values(partners_registry, months))
+
+        # File name
+        file_name = f"energy/community/data/supplies_comparison_report_{month_first_day.strftime('%Y-%m')}.{args.format}"
+
+        if args.format == "parquet":
+            write_parquet_report(file_name, get_comparison_report_table(columns))
+        else:
+            write_csv_report(file_name, REPORT_HEADER, get_comparison_report_rows(columns))
+
+    except Exception as e:
+        logging.error(f"Error: {e}")
+
+    pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
+
+    logging.info(f"Process {script_name} finished.")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 ##
 # Generates a report with all the following data for each community supply by month
+# (or for a range of months, with one report by month and one with the totals of the range,
+# or for a month with one report by partner)
 # - CUPS
 # - Beta
 # - Final consumption
@@ -8,24 +10,29 @@
 # - Self consumption percentage
 # - Utilization percentage
 ##
-from datetime import datetime, timedelta
-import json
-import csv
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import argparse
-from influxdb import InfluxDBClient
+import hashlib
 import logging
 import os
+import re
+import sys
+import zipfile
 from dotenv import load_dotenv
 
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import pipeline_metrics
+from common.influxdb_session import get_influxdb_client
+from common.partners_registry import get_file_hash, load_partners_registry
+from common.time_grid import TIMEZONE, HourGrid, get_hour_grid, get_month_hour_grid, get_month_last_day, get_months
+from report_cache import get_cache_key, get_data_fingerprint, restore_cached_report, store_cached_report
+from report_files import REPORT_FORMATS, check_parquet_available, get_dictionary_column, get_report_table, write_csv_report, write_parquet_report
+
 # Load environment variables from the .env file in the current directory
 load_dotenv()
 
-INFLUXDB_HOST = os.getenv("INFLUXDB_HOST")
-INFLUXDB_PORT = int(os.getenv("INFLUXDB_PORT"))
-INFLUXDB_DATABASE = os.getenv("INFLUXDB_DATABASE")
-INFLUXDB_USER = os.getenv("INFLUXDB_USER")
-INFLUXDB_PASSWORD = os.getenv("INFLUXDB_PASSWORD")
-
 COMMUNITY_PARTNERS_FILE_PATH=os.getenv("COMMUNITY_PARTNERS_FILE_PATH")
 
 # Get the absolute path of the currently executing script
@@ -52,16 +59,17 @@ def get_script_name()-> str:
     # Get the base name of the script (without extension)
     return os.path.splitext(os.path.basename(script_path))[0]
 
-def create_influxdb_client():
-    return InfluxDBClient(host=INFLUXDB_HOST, port=INFLUXDB_PORT, database=INFLUXDB_DATABASE, username=INFLUXDB_USER, password=INFLUXDB_PASSWORD)
-
-def close_influxdb_client(client:InfluxDBClient):
-    client.close()
-
 ##
-# Get the month passed by argument with format YYYY-mm
+# Get the arguments of the script:
+# - month: month of the report with format YYYY-mm
+# - end_month: optional last month of a range of months with format YYYY-mm
+# - format: format of the report file, "csv" or "parquet"
+# - force: generate the report even if it is found in the cache
+# - partners: generate one report by partner instead of the report of the whole community
+# - zip: also bundle the reports of the partners into a zip file
+# - workers: maximum number of threads writing the reports of the partners at the same time
 ##
-def get_month_first_day()-> datetime:
+def get_arguments()-> argparse.Namespace:
 
     # Function to validate the date format 
     def validate_date(date_str):
@@ -75,26 +83,29 @@ def get_month_first_day()-> datetime:
 
     # Define the expected arguments
     parser.add_argument('month', type=validate_date, help='Year and month in "yyyy-mm" format')
+    parser.add_argument('end_month', type=validate_date, nargs='?', help='Last year and month in "yyyy-mm" format to generate the reports of a range of months')
+    parser.add_argument('--format', choices=REPORT_FORMATS, default='csv', help='Format of the report file')
+    parser.add_argument('--force', action='store_true', help='Generate the report even if it is found in the cache')
+    parser.add_argument('--partners', action='store_true', help='Generate one report by partner of the community')
+    parser.add_argument('--zip', action='store_true', help='Bundle the reports of the partners into a zip file')
+    parser.add_argument('--workers', type=int, default=min(8, os.cpu_count() or 1), help='Maximum number of threads writing the reports of the partners')
 
     # Parse the command-line arguments
     args = parser.parse_args()
 
-    return args.month
+    if args.end_month is not None and args.end_month < args.month:
+        parser.error(f"End month {args.end_month.strftime('%Y-%m')} is before month {args.month.strftime('%Y-%m')}.")
 
-def get_month_last_day(month_first_day:datetime)-> datetime:
+    if args.partners and args.end_month is not None:
+        parser.error("The reports of the partners are generated for a single month.")
 
-    # Iterate by every day of the month
-    month:int = month_first_day.month
-    year:int = month_first_day.year
-    
-    # Determine the last day of the month
-    if month == 12:
-        last_day:datetime = datetime(year + 1, 1, 1) - timedelta(days=1)
-    else:
-        last_day:datetime = datetime(year, month + 1, 1) - timedelta(days=1)
+    if args.zip and not args.partners:
+        parser.error("The zip bundle needs the reports of the partners (--partners).")
 
-    return last_day
+    if args.workers < 1:
+        parser.error(f"Workers {args.workers} must be greater than zero.")
 
+    return args
 
 ##
 # Transform a datetime into a date in RFC3339 format that InfluxDB can understand
@@ -105,117 +116,325 @@ def get_influx_date(month_date:datetime)-> str:
     return month_date.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 ##
-# Transform the result of a query to a InfluxDB into a float value
-# If there is an error during the transformation, returns a 0.0
+# Fields of the "community_supply" measurement aggregated in the report
 ##
-def get_value_as_float(result, field:str)-> float:
+REPORT_FIELDS:tuple = ("consumption_final", "surplus", "self_consumption")
+
+# Header of the CSV report and names of the columns of the Parquet report
+REPORT_HEADER:list = ["CUPS", "COEF REP", "CONSUMO FINAL", "EXCEDENTE", "AUTOCONSUMO", "% AUTOCON", "% APROVECHAMIENTO"]
+REPORT_COLUMNS:list = ["cups", "beta", "consumption_final", "surplus", "self_consumption", "self_consumption_percentage", "utilization_percentage"]
+
+##
+# Get the aggregated values of all the supplies for an interval with a single query grouped by CUPS.
+# The values are added up from the hourly "community_supply" measurement or from one of its rollups.
+# Returns a map by CUPS with the sum of every report field
+##
+def get_supplies_values_by_interval(first_hour:datetime, end_hour:datetime, measurement:str="community_supply")-> dict:
 
     try:
-        # If nothing is found, return zero
-        if len(result.keys()) == 0:
-            return 0.0
-        
-        # Access the measurement name (it's the first key in the ResultSet)
-        measurement = list(result.keys())[0]
-
-        # Access the data points for that measurement
-        data_points = result[measurement]
-
-        # Iterate through the data points
-        for point in data_points:
-            value = point[field]            
-            return value
-        
+        client = get_influxdb_client()
+
+        aggregates:str = ", ".join(f'SUM("{field}") AS "{field}"' for field in REPORT_FIELDS)
+        query:str = f'SELECT {aggregates} FROM "{measurement}" WHERE time >= \'{get_influx_date(first_hour)}\' AND time < \'{get_influx_date(end_hour)}\' GROUP BY "cups"'
+        with pipeline_metrics.stage("influxdb_read"):
+            result = client.query(query)
+
+        supplies_values:dict = {}
+        for (measurement, tags), points in result.items():
+            for point in points:
+                supplies_values[tags["cups"]] = {field: point[field] or 0.0 for field in REPORT_FIELDS}
+
+        return supplies_values
+
     except Exception as e:
-        logging.error(f"Error extracting the value {field} as float from an InfluxDB query result.", e)
+        logging.error(f"Error getting aggregate values of {measurement} by cups from {first_hour} to {end_hour}: {e}")
         raise e
 
 ##
-# Get aggreagate production by CUPS for a given month
+# Get the aggregated values of all the supplies by local month for an interval with a single query
+# bucketed by local day and grouped by CUPS. Days are added up into months in memory.
+# Returns a map by month (YYYY-mm) of maps by CUPS with the sum of every report field
 ##
-def get_value_by_cups_and_interval(field:str, cups:str, first_day:datetime, last_day:datetime)-> float:
+def get_supplies_values_by_month(first_hour:datetime, end_hour:datetime, measurement:str="community_supply")-> dict:
+    return get_supplies_values_by_intervals([(first_hour, end_hour)], measurement)
+
+##
+# Get the aggregated values of all the supplies by local month for many intervals (first hour and end hour).
+# Every interval is a statement of a single request, so intervals far apart are read without the hours between them.
+# Returns a map by month (YYYY-mm) of maps by CUPS with the sum of every report field
+##
+def get_supplies_values_by_intervals(intervals:list, measurement:str="community_supply")-> dict:
 
     try:
-        client = create_influxdb_client()
+        client = get_influxdb_client()
+
+        aggregates:str = ", ".join(f'SUM("{field}") AS "{field}"' for field in REPORT_FIELDS)
+        statements:list = [f'SELECT {aggregates} FROM "{measurement}" WHERE time >= \'{get_influx_date(first_hour)}\' AND time < \'{get_influx_date(end_hour)}\' GROUP BY time(1d), "cups" fill(none) tz(\'{TIMEZONE.zone}\')' for first_hour, end_hour in intervals]
+        with pipeline_metrics.stage("influxdb_read"):
+            results = client.query("; ".join(statements))
+
+        # The client returns a list of results only when the request has many statements
+        if not isinstance(results, list):
+            results = [results]
+
+        with pipeline_metrics.stage("calculation"):
+            monthly_values:dict = {}
+            for result in results:
+                for (measurement, tags), points in result.items():
+                    for point in points:
+                        # Days are returned with the offset of the time zone, so the local month is the start of the date
+                        supply_values:dict = monthly_values.setdefault(point["time"][:7], {}).setdefault(tags["cups"], {field: 0.0 for field in REPORT_FIELDS})
+                        for field in REPORT_FIELDS:
+                            supply_values[field] += point[field] or 0.0
 
-        query:str = f'SELECT SUM("{field}") AS "{field}" FROM "community_supply" WHERE "cups" = \'{cups}\' and time >= \'{get_influx_date(first_day)}\' AND time <= \'{get_influx_date(last_day)}\''
-        result = client.query(query)
+        return monthly_values
 
-        close_influxdb_client(client)
-            
-        return get_value_as_float(result, field)
-    
     except Exception as e:
-        logging.error(f"Error getting aggreagate production by cups {cups} for month {first_day}.", e)
+        logging.error(f"Error getting aggregate values by month and cups for {[(str(first_hour), str(end_hour)) for first_hour, end_hour in intervals]}: {e}")
         raise e
-    
+
 ##
-# Main function
+# Add up the values of all the supplies of many months
 ##
-def main():
+def get_supplies_total_values(monthly_values:dict)-> dict:
 
-    script_name = get_script_name()
+    total_values:dict = {}
+    for supplies_values in monthly_values.values():
+        for cups, values in supplies_values.items():
+            supply_total_values:dict = total_values.setdefault(cups, {field: 0.0 for field in REPORT_FIELDS})
+            for field in REPORT_FIELDS:
+                supply_total_values[field] += values[field]
 
-    logging.info(f"Process {script_name} started.")
+    return total_values
 
-    try:
+##
+# Build the rows of the report for the supplies of the registry with their aggregated values.
+# All the supplies are included unless the indexes of some of them are received
+##
+def get_supplies_report_rows(partners_registry, supplies_values:dict, supplies_indexes=None)-> list:
+
+    # Supplies without data in the interval get zero values
+    empty_values:dict = {field: 0.0 for field in REPORT_FIELDS}
+
+    rows:list = []
+
+    if supplies_indexes is None:
+        supplies_indexes = range(len(partners_registry))
+
+    # Loop the list of supplies
+    for supply_index in supplies_indexes:
+
+        cups = partners_registry.cups[supply_index]
+        beta = float(partners_registry.betas[supply_index])
+
+        values:dict = supplies_values.get(cups, empty_values)
+
+        # Get supply final consumption, surplus and self consumption
+        consumption_final = values["consumption_final"]
+        surplus = values["surplus"]
+        self_consumption = values["self_consumption"]
+
+        # Calculate supply self consumption percentage
+        self_consumption_percentage:float = 0.0
+        if (self_consumption + consumption_final) > 0.0:
+            self_consumption_percentage = self_consumption / (self_consumption + consumption_final)
+
+        # Calculate utilization percentage
+        utilization_percentage:float = 0.0
+        if (self_consumption + surplus) > 0.0 :
+            utilization_percentage = self_consumption / (self_consumption + surplus)
+
+        rows.append([cups, beta, consumption_final, surplus, self_consumption, self_consumption_percentage, utilization_percentage])
+
+    return rows
+
+##
+# Build the typed table of the report from its rows, CUPS are dictionary encoded
+##
+def get_supplies_report_table(rows:list):
+
+    columns:dict = {name: [row[column_index] for row in rows] for column_index, name in enumerate(REPORT_COLUMNS)}
+    columns["cups"] = get_dictionary_column(columns["cups"])
+
+    return get_report_table(columns)
+
+##
+# Write the report of a list of rows in a format
+##
+def write_supplies_report(file_name:str, file_format:str, rows:list):
+
+    if file_format == "parquet":
+        write_parquet_report(file_name, get_supplies_report_table(rows))
+    else:
+        write_csv_report(file_name, REPORT_HEADER, rows)
+
+# Measurements read for the values of a month: the monthly rollup and, when it is not available, the hourly data.
+# The data fingerprint of the report is taken from the same measurements
+MONTH_VALUES_MEASUREMENTS:tuple = ("community_supply_monthly", "community_supply")
+
+##
+# Get the values of all the supplies for a month with a single query, from the monthly rollup if it is available
+##
+def get_month_supplies_values(hour_grid:HourGrid)-> dict:
+
+    rollup_measurement, hourly_measurement = MONTH_VALUES_MEASUREMENTS
+
+    supplies_values:dict = get_supplies_values_by_interval(hour_grid.utc_start, hour_grid.utc_end, rollup_measurement)
+    if not supplies_values:
+        logging.info("Monthly rollup not available, adding up the hourly data.")
+        supplies_values = get_supplies_values_by_interval(hour_grid.utc_start, hour_grid.utc_end, hourly_measurement)
+
+    return supplies_values
+
+##
+# Group the supplies of the registry by partner, using the DNI or the name if the partner has no DNI.
+# Returns a map by partner with the indexes of its supplies
+##
+def get_partners_supplies(partners_registry)-> dict:
+
+    partners_supplies:dict = {}
+    for partner_index in range(partners_registry.partners_count()):
+        partner:str = partners_registry.partner_dnis[partner_index] or partners_registry.partner_names[partner_index]
+        partners_supplies.setdefault(partner, []).extend(partners_registry.partner_supplies(partner_index))
+
+    return partners_supplies
+
+##
+# Get the name of the report of a partner, valid as a file name. When characters of the partner have to be
+# replaced, a short hash of the partner is added so that partners like "Comunidad Nº 1" and "Comunidad N 1"
+# never get the same file
+##
+def get_partner_report_name(month:str, partner:str, file_format:str)-> str:
+
+    partner_key:str = re.sub(r"[^A-Za-z0-9_-]+", "_", str(partner)).strip("_")
+    if partner_key != str(partner):
+        partner_key = f"{partner_key}_{hashlib.sha256(str(partner).encode('utf-8')).hexdigest()[:8]}"
+
+    return f"supplies_report_{month}_{partner_key}.{file_format}"
+
+##
+# Generate the report of every partner for a month from a single fetch of the data of the month.
+# Reports are written in parallel threads and optionally bundled into a zip file
+##
+def generate_partners_reports(partners_registry, month_first_day:datetime, file_format:str, zip_bundle:bool, workers:int):
+
+    month:str = month_first_day.strftime('%Y-%m')
+
+    # Exact hours of the month, taking into account the changes of time
+    hour_grid:HourGrid = get_month_hour_grid(month_first_day.year, month_first_day.month)
+
+    supplies_values:dict = get_month_supplies_values(hour_grid)
+
+    # Reports of the partners are stored in their own directory
+    directory:str = f"energy/community/data/partners_reports_{month}"
+    os.makedirs(directory, exist_ok=True)
+
+    # Function to write the report of a partner
+    def write_partner_report(partner:str, supplies_indexes:list)-> str:
+        file_name:str = os.path.join(directory, get_partner_report_name(month, partner, file_format))
+        write_supplies_report(file_name, file_format, get_supplies_report_rows(partners_registry, supplies_values, supplies_indexes))
+        return file_name
+
+    partners_supplies:dict = get_partners_supplies(partners_registry)
+
+    with pipeline_metrics.stage("file_write"), ThreadPoolExecutor(max_workers=workers) as executor:
+        file_names:list = list(executor.map(write_partner_report, partners_supplies.keys(), partners_supplies.values()))
 
-         # Open the JSON file for reading with all the partners with all their supplies
-        with open(COMMUNITY_PARTNERS_FILE_PATH, 'r') as partners_file:
-            partners = json.load(partners_file)
+    logging.info(f"Reports of {len(file_names)} partners generated in {directory}.")
 
-        month_first_day:datetime = get_month_first_day()
-        month_last_day:datetime = get_month_last_day(month_first_day)
-        
-        # File name
-        csv_file_name = f"energy/community/data/supplies_report_{month_first_day.strftime('%Y-%m')}.csv"
+    if zip_bundle:
+        zip_file_name:str = f"energy/community/data/partners_reports_{month}.zip"
+        with pipeline_metrics.stage("file_write"), zipfile.ZipFile(zip_file_name, mode='w', compression=zipfile.ZIP_DEFLATED) as bundle:
+            for file_name in file_names:
+                bundle.write(file_name, arcname=os.path.basename(file_name))
 
-        # Open the CSV file in write mode
-        # We use newline='' to ensure consistent line endings on all platforms
-        with open(csv_file_name, mode='w', newline='') as file:
-            # Create a CSV writer object
-            writer = csv.writer(file, delimiter=';')
+        logging.info(f"Reports of the partners bundled into {zip_file_name}.")
 
-            # Write header
-            header = ["CUPS", "COEF REP", "CONSUMO FINAL", "EXCEDENTE", "AUTOCONSUMO", "% AUTOCON", "% APROVECHAMIENTO"]
-            writer.writerow(header)
+##
+# Generate the report of a month, served from the cache if its inputs did not change
+##
+def generate_month_report(partners_registry, month_first_day:datetime, file_format:str, force:bool):
+
+    # Exact hours of the month, taking into account the changes of time
+    hour_grid:HourGrid = get_month_hour_grid(month_first_day.year, month_first_day.month)
+
+    # File name
+    file_name = f"energy/community/data/supplies_report_{month_first_day.strftime('%Y-%m')}.{file_format}"
 
-            # Loop the list of partners
-            for partner in partners:
-                supplies = partner["supplies"]
-                
-                # Loop the list of supplies by partner
-                for supply in supplies:
+    # Key of the report in the cache, it changes when the partners or the data of the month change
+    cache_key:str = get_cache_key("supplies_report", month_first_day.strftime('%Y-%m'), {
+        "format": file_format,
+        "partners": get_file_hash(COMMUNITY_PARTNERS_FILE_PATH),
+        "data": get_data_fingerprint(hour_grid.utc_start, hour_grid.utc_end, MONTH_VALUES_MEASUREMENTS),
+    })
 
-                    cups = supply["cups"]
-                    beta = supply["beta"]
+    if not force and restore_cached_report(cache_key, file_name):
+        logging.info("Inputs of the report not changed since a previous run.")
+        return
 
-                    # Get supply final consumption
-                    consumption_final = get_value_by_cups_and_interval("consumption_final", cups, month_first_day, month_last_day)
+    supplies_values:dict = get_month_supplies_values(hour_grid)
 
-                    # Get supply surplus
-                    surplus = get_value_by_cups_and_interval("surplus", cups, month_first_day, month_last_day)
+    write_supplies_report(file_name, file_format, get_supplies_report_rows(partners_registry, supplies_values))
 
-                    # Get supply self consumption
-                    self_consumption = get_value_by_cups_and_interval("self_consumption", cups, month_first_day, month_last_day)
+    store_cached_report(cache_key, file_name)
+
+##
+# Generate the reports of every month of a range and the report with the totals of the range in one pass.
+# All the months are fetched with a single query
+##
+def generate_range_report(partners_registry, first_month:datetime, last_month:datetime, file_format:str):
 
-                    # Calculate supply self consumption percentage
-                    self_consumption_percentage:float = 0.0
-                    if (self_consumption + consumption_final) > 0.0:
-                        self_consumption_percentage = self_consumption / (self_consumption + consumption_final)
+    months:list = [month_first_day.strftime('%Y-%m') for month_first_day in get_months(first_month, last_month)]
 
-                    # Calculate utilization percentage
-                    utilization_percentage:float = 0.0
-                    if (self_consumption + surplus) > 0.0 :
-                        utilization_percentage = self_consumption / (self_consumption + surplus)
+    # Exact hours of the range, taking into account the changes of time
+    hour_grid:HourGrid = get_hour_grid(first_month, get_month_last_day(last_month))
 
-                    row =  [cups, beta, consumption_final, surplus, self_consumption, self_consumption_percentage, utilization_percentage]
+    # Get the values of all the supplies by month, from the monthly rollup if it has all the months
+    monthly_values:dict = get_supplies_values_by_month(hour_grid.utc_start, hour_grid.utc_end, "community_supply_monthly")
+    if set(monthly_values) != set(months):
+        logging.info("Monthly rollup not available for all the months, adding up the hourly data.")
+        monthly_values = get_supplies_values_by_month(hour_grid.utc_start, hour_grid.utc_end)
 
-                    writer.writerow(row)
+    with pipeline_metrics.stage("file_write"):
+        for month in months:
+            write_supplies_report(f"energy/community/data/supplies_report_{month}.{file_format}", file_format, get_supplies_report_rows(partners_registry, monthly_values.get(month, {})))
+
+        write_supplies_report(f"energy/community/data/supplies_report_{months[0]}_{months[-1]}.{file_format}", file_format, get_supplies_report_rows(partners_registry, get_supplies_total_values(monthly_values)))
+
+    logging.info(f"Reports of {len(months)} months and their totals generated.")
+
+##
+# Main function
+##
+def main():
+
+    script_name = get_script_name()
+
+    logging.info(f"Process {script_name} started.")
+
+    try:
+
+        # Registry with all the partners with all their supplies
+        partners_registry = load_partners_registry(COMMUNITY_PARTNERS_FILE_PATH)
+
+        args:argparse.Namespace = get_arguments()
+        month_first_day:datetime = args.month
+
+        if args.format == "parquet":
+            check_parquet_available()
+
+        if args.partners:
+            generate_partners_reports(partners_registry, month_first_day, args.format, args.zip, args.workers)
+        elif args.end_month is None:
+            generate_month_report(partners_registry, month_first_day, args.format, args.force)
+        else:
+            generate_range_report(partners_registry, month_first_day, args.end_month, args.format)
 
     except Exception as e:
         logging.error("Error:", e)    
 
+    pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
+
     logging.info(f"Process {script_name} finished.")
 
 if __name__ == "__main__":
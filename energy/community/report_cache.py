@@ -0,0 +1,128 @@
+##
+# Content-addressed cache of the files generated by the community reports.
+# The key of a report is a hash of everything its content depends on:
+# - name of the report, period and format
+# - inputs of the report, like the hash of the partners file
+# - fingerprint of the data of the period: number of points and sums of the main fields of the measurement
+#   the report reads, like the monthly rollup ("community_supply_monthly") for the supply report, or of
+#   the measurement it falls back to when it has no data
+# When the key of a report matches a previous run, the stored file is served instead of querying InfluxDB again.
+# Files are stored in the directory data/cache of the community scripts.
+##
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+from common import pipeline_metrics
+from common.atomic_files import open_atomic_file
+from common.influxdb_session import get_influxdb_client
+
+# Directory where the files of the reports are stored by key
+CACHE_DIRECTORY = os.getenv("COMMUNITY_REPORT_CACHE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cache")
+
+# Fields included in the data fingerprint
+FINGERPRINT_FIELDS:tuple = ("surplus", "consumption_final", "self_consumption")
+
+# Measurements used by default for the data fingerprint of the reports built from the hourly data, from
+# the cheapest one. The loader writes the daily rollup of a day together with its hours, so any rewrite
+# of the hourly data changes the daily rollup too
+FINGERPRINT_MEASUREMENTS:tuple = ("community_supply_daily", "community_supply")
+
+##
+# Transform a datetime into a date in RFC3339 format that InfluxDB can understand
+##
+def get_influx_date(month_date:datetime)-> str:
+
+    # Format the datetime object as an InfluxDB-compatible timestamp string (RFC3339 format)
+    return month_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+##
+# Get the fingerprint of a measurement for an interval with a single aggregate query
+##
+def get_measurement_fingerprint(measurement:str, first_hour:datetime, end_hour:datetime)-> dict:
+
+    client = get_influxdb_client()
+
+    aggregates:str = ", ".join([f'COUNT("{FINGERPRINT_FIELDS[0]}") AS "points"'] + [f'SUM("{field}") AS "{field}"' for field in FINGERPRINT_FIELDS])
+    query:str = f'SELECT {aggregates} FROM "{measurement}" WHERE time >= \'{get_influx_date(first_hour)}\' AND time < \'{get_influx_date(end_hour)}\''
+    with pipeline_metrics.stage("influxdb_read"):
+        result = client.query(query)
+
+    for point in result.get_points():
+        return {"points": point["points"] or 0, **{field: point[field] for field in FINGERPRINT_FIELDS}}
+
+    return {"points": 0}
+
+##
+# Get a cheap fingerprint of the data of an interval, from the first of the measurements that has data for
+# the interval. Reports pass the measurements they read, in the same order, so that the fingerprint changes
+# whenever the data they read changes. InfluxDB does not keep the time when points are written, so any
+# rewrite is detected through the number of points and the sums of the main fields
+##
+def get_data_fingerprint(first_hour:datetime, end_hour:datetime, measurements:tuple=FINGERPRINT_MEASUREMENTS)-> dict:
+
+    try:
+        for measurement in measurements:
+            fingerprint:dict = get_measurement_fingerprint(measurement, first_hour, end_hour)
+            if fingerprint["points"] > 0:
+                return {"measurement": measurement, **fingerprint}
+
+        return {"points": 0}
+
+    except Exception as e:
+        logging.error(f"Error getting the data fingerprint from {first_hour} to {end_hour}: {e}")
+        raise e
+
+##
+# Get the key of a report from its name, period and all the inputs it depends on
+##
+def get_cache_key(report:str, period:str, inputs:dict)-> str:
+
+    content:str = json.dumps({"report": report, "period": period, "inputs": inputs}, sort_keys=True, default=str)
+
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+##
+# Get the path of the file stored in the cache for a key, keeping the extension of the report
+##
+def get_cached_report_path(cache_key:str, file_path:str)-> str:
+
+    extension:str = os.path.basename(file_path).split(".", 1)[-1]
+
+    return os.path.join(CACHE_DIRECTORY, f"{cache_key}.{extension}")
+
+##
+# Copy the file stored in the cache for a key into the path of the report.
+# Returns whether the report was found in the cache
+##
+def restore_cached_report(cache_key:str, file_path:str)-> bool:
+
+    cached_file_path:str = get_cached_report_path(cache_key, file_path)
+
+    if not os.path.exists(cached_file_path):
+        pipeline_metrics.increment("report_cache_misses")
+        return False
+
+    with open(cached_file_path, 'rb') as cached_file, open_atomic_file(file_path) as report_file:
+        shutil.copyfileobj(cached_file, report_file)
+    pipeline_metrics.increment("report_cache_hits")
+
+    logging.info(f"Report {file_path} served from the cache {cached_file_path}.")
+
+    return True
+
+##
+# Store the file of a report in the cache with its key
+##
+def store_cached_report(cache_key:str, file_path:str):
+
+    cached_file_path:str = get_cached_report_path(cache_key, file_path)
+
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+
+    with open(file_path, 'rb') as report_file, open_atomic_file(cached_file_path) as cached_file:
+        shutil.copyfileobj(report_file, cached_file)
+
+    logging.info(f"Report {file_path} stored in the cache {cached_file_path}.")
@@ -0,0 +1,189 @@
+##
+# Writers of the files generated by the community reports:
+# - CSV separated by semicolons, the format expected by the distributor and the partners.
+#   Rows are streamed from any iterable (for example a generator) through large buffers, optionally
+#   compressed with gzip or zstd, so memory does not depend on the number of rows
+# - Parquet, with typed columns, for analysis. Parquet files can be loaded with memory-mapped reads,
+#   for example: pyarrow.parquet.read_table(file_path, memory_map=True)
+# Files are written atomically with common.atomic_files. Parquet needs the optional package pyarrow
+# and zstd compression of CSV files needs the optional package zstandard.
+##
+import csv
+import io
+import numpy as np
+from common.atomic_files import COMPRESSIONS, check_compression_available, get_temporary_file_path, open_atomic_file, remove_temporary_file, replace_file
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Formats of the files of the reports
+REPORT_FORMATS:tuple = ("csv", "parquet")
+
+# Compressions of the CSV files and extensions they add to the file names
+CSV_COMPRESSIONS:dict = COMPRESSIONS
+
+##
+# Check that the Parquet format can be written
+##
+def check_parquet_available():
+
+    if pa is None:
+        raise RuntimeError("The Parquet format needs the package pyarrow. Install it with: pip install pyarrow")
+
+##
+# Write the rows of a report into a CSV file separated by semicolons.
+# Rows are consumed one by one, so they can be produced by a generator of any length.
+# Returns the number of rows written
+##
+def write_csv_report(file_path:str, header:list, rows, compression:str="none")-> int:
+
+    rows_written:int = 0
+
+    with open_atomic_file(file_path, compression) as file:
+
+        # We use newline='' to ensure consistent line endings on all platforms
+        text_file = io.TextIOWrapper(file, encoding='utf-8', newline='')
+
+        # Create a CSV writer object
+        writer = csv.writer(text_file, delimiter=';')
+
+        # Write header
+        writer.writerow(header)
+
+        for row in rows:
+            writer.writerow(row)
+            rows_written += 1
+
+        # Release the binary file without closing it, it is closed when the atomic write finishes
+        text_file.flush()
+        text_file.detach()
+
+    return rows_written
+
+##
+# Get the content of a CSV report separated by semicolons, for reports served from memory
+##
+def get_csv_bytes(header:list, rows)-> bytes:
+
+    text_file = io.StringIO(newline='')
+
+    # Create a CSV writer object
+    writer = csv.writer(text_file, delimiter=';')
+
+    # Write header
+    writer.writerow(header)
+
+    writer.writerows(rows)
+
+    return text_file.getvalue().encode('utf-8')
+
+##
+# Get the content of a Parquet report, for reports served from memory
+##
+def get_parquet_bytes(table)-> bytes:
+
+    check_parquet_available()
+
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, compression="zstd")
+
+    return sink.getvalue().to_pybytes()
+
+##
+# Build an Arrow column of text values with dictionary encoding, useful for repeated values like CUPS
+##
+def get_dictionary_column(values):
+
+    check_parquet_available()
+
+    return pa.array(values, type=pa.string()).dictionary_encode()
+
+##
+# Build an Arrow table from a map of columns by name.
+# Columns can be Arrow arrays, NumPy arrays or lists
+##
+def get_report_table(columns:dict):
+
+    check_parquet_available()
+
+    return pa.table({name: values if isinstance(values, (pa.Array, pa.ChunkedArray)) else pa.array(values) for name, values in columns.items()})
+
+##
+# Write an Arrow table into a Parquet file
+##
+def write_parquet_report(file_path:str, table):
+
+    check_parquet_available()
+
+    with open_atomic_file(file_path) as file:
+        pq.write_table(table, file, compression="zstd")
+
+##
+# Writer of Parquet files built from many tables with the same columns, one row group by table.
+# It is used to write long periods month by month without keeping the whole period in memory
+##
+class ParquetReportWriter:
+
+    def __init__(self, file_path:str, schema):
+
+        check_parquet_available()
+
+        self.file_path:str = file_path
+        self.rows_written:int = 0
+
+        # The file is written into a temporary file that replaces it when the writer is closed
+        self._temporary_file_path:str = get_temporary_file_path(file_path)
+        self._writer = pq.ParquetWriter(self._temporary_file_path, schema, compression="zstd")
+
+    ##
+    # Write a table as a single row group
+    ##
+    def write(self, table):
+
+        if table.num_rows == 0:
+            return
+
+        self._writer.write_table(table, row_group_size=table.num_rows)
+        self.rows_written += table.num_rows
+
+    def close(self):
+        self._writer.close()
+        replace_file(self._temporary_file_path, self.file_path)
+
+    ##
+    # Close the writer without keeping the file
+    ##
+    def discard(self):
+        self._writer.close()
+        remove_temporary_file(self._temporary_file_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+##
+# Get the values of a NumPy array as floats, NaN values are returned as missing values
+##
+def get_nullable_floats(values:np.ndarray):
+
+    check_parquet_available()
+
+    values = np.asarray(values, dtype=np.float64)
+
+    return pa.array(values, type=pa.float64(), mask=np.isnan(values))
+
+##
+# Get the values of a NumPy array as integers, NaN values are returned as missing values
+##
+def get_nullable_integers(values:np.ndarray):
+
+    return get_nullable_floats(values).cast(pa.int64())
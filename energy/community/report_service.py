@@ -0,0 +1,353 @@
+##
+# Local HTTP service that serves the community reports, so dashboards do not need to run the scripts by hand.
+# Endpoints:
+# - /supplies/YYYY-mm.{csv|json|parquet}: report of the supplies of the month
+#   optional parameters: cups=<CUPS> to get a single supply, partner=<DNI> to get the supplies of a partner
+#   (partner=<name> only for partners without DNI, the same keys used by the reports of the partners)
+# - /compensation/YYYY-mm.{csv|json|parquet}: hourly surplus of the community for every day of the month
+# Responses, and the data of the months used to build them, are kept in an in-process LRU cache. Cached entries
+# depend on the fingerprint of the data of the month that the report reads, that is checked again after some
+# seconds, so new data written by the loader makes the service build the reports again.
+##
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Get the absolute path of the currently executing script
+script_path = os.path.abspath(__file__)
+
+# Get the directory containing the script
+script_directory = os.path.dirname(script_path)
+
+# Get the base name of the script (without extension)
+script_name = os.path.splitext(os.path.basename(script_path))[0]
+
+# Logging configuration, before the reports are imported so the service logs into its own file
+log_file_path = f"{script_directory}/logs/{script_name}.log"
+log_format = "%(asctime)s - %(levelname)s - %(message)s"
+logging.basicConfig(filename=log_file_path, encoding='utf-8', level=logging.INFO, format=log_format)
+
+from common import pipeline_metrics
+from common.partners_registry import get_file_hash, load_partners_registry
+from common.time_grid import HourGrid, get_month_hour_grid
+from report_cache import FINGERPRINT_MEASUREMENTS, get_data_fingerprint
+import report_files
+import generate_compensation_report_by_month as compensation_report
+import generate_supply_report_by_month as supply_report
+
+# Load environment variables from the .env file in the current directory
+load_dotenv()
+
+COMMUNITY_PARTNERS_FILE_PATH=os.getenv("COMMUNITY_PARTNERS_FILE_PATH")
+
+# Content type of every format of the reports
+CONTENT_TYPES:dict = {
+    "csv": "text/csv; charset=utf-8",
+    "json": "application/json",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Path of the requests: /<report>/<month>.<format>
+REQUEST_PATH = re.compile(r"^/(supplies|compensation)/(\d{4}-\d{2})\.(csv|json|parquet)$")
+
+##
+# Error of a request, answered with its HTTP status
+##
+class ReportRequestError(Exception):
+
+    def __init__(self, status:int, message:str):
+        super().__init__(message)
+        self.status:int = status
+
+##
+# Least recently used cache with a maximum number of entries, safe to be used by many threads
+##
+class LRUCache:
+
+    def __init__(self, max_entries:int):
+
+        self.max_entries:int = max_entries
+        self.hits:int = 0
+        self.misses:int = 0
+        self._entries:OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    ##
+    # Get the value of a key, building and storing it if it is not in the cache.
+    # Returns the value and whether it was found in the cache
+    ##
+    def get(self, key, build)-> tuple:
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key], True
+
+        # Values are built out of the lock, so slow reports do not block the rest of the requests
+        value = build()
+
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return value, False
+
+##
+# Fingerprints of the data by month and measurements read, checked again in InfluxDB after some seconds
+##
+class DataFingerprints:
+
+    def __init__(self, ttl:float):
+
+        self.ttl:float = ttl
+        self._fingerprints:dict = {}
+        self._lock = threading.Lock()
+
+    ##
+    # Get the fingerprint of the data of a month in the measurements read by a report
+    ##
+    def get(self, month:str, hour_grid:HourGrid, measurements:tuple)-> str:
+
+        with self._lock:
+            fingerprint, checked_at = self._fingerprints.get((month, measurements), (None, 0.0))
+            if fingerprint is not None and time.monotonic() - checked_at < self.ttl:
+                return fingerprint
+
+        fingerprint = json.dumps(get_data_fingerprint(hour_grid.utc_start, hour_grid.utc_end, measurements), sort_keys=True)
+
+        with self._lock:
+            self._fingerprints[(month, measurements)] = (fingerprint, time.monotonic())
+
+        return fingerprint
+
+##
+# Get the arguments of the script:
+# - host: address where the service listens
+# - port: port where the service listens
+# - cache_size: maximum number of responses and months kept in the cache
+# - fingerprint_ttl: seconds before the fingerprint of the data of a month is checked again
+##
+def get_arguments()-> argparse.Namespace:
+
+    # Create an ArgumentParser object
+    parser = argparse.ArgumentParser(description='Local HTTP service that serves the community reports')
+
+    # Define the expected arguments
+    parser.add_argument('--host', default=os.getenv("REPORT_SERVICE_HOST", "127.0.0.1"), help='Address where the service listens')
+    parser.add_argument('--port', type=int, default=int(os.getenv("REPORT_SERVICE_PORT", "8080")), help='Port where the service listens')
+    parser.add_argument('--cache-size', type=int, default=256, help='Maximum number of responses and months kept in the cache')
+    parser.add_argument('--fingerprint-ttl', type=float, default=60.0, help='Seconds before the fingerprint of the data of a month is checked again')
+
+    # Parse the command-line arguments
+    return parser.parse_args()
+
+##
+# Get the first day of a month with format YYYY-mm
+##
+def get_month_first_day(month:str)-> datetime:
+
+    try:
+        return datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        raise ReportRequestError(400, f"Month {month} has an invalid format. Use yyyy-mm.")
+
+##
+# Service with the caches shared by all the requests
+##
+class ReportService:
+
+    def __init__(self, cache_size:int, fingerprint_ttl:float):
+
+        self.cache:LRUCache = LRUCache(cache_size)
+        self.fingerprints:DataFingerprints = DataFingerprints(fingerprint_ttl)
+
+    ##
+    # Get the content of a report. Returns the content and whether it was found in the cache
+    ##
+    def get_report(self, report:str, month:str, file_format:str, parameters:dict)-> tuple:
+
+        month_first_day:datetime = get_month_first_day(month)
+
+        if file_format == "parquet" and report_files.pa is None:
+            raise ReportRequestError(501, "The Parquet format needs the package pyarrow.")
+
+        # Exact hours of the month, taking into account the changes of time
+        hour_grid:HourGrid = get_month_hour_grid(month_first_day.year, month_first_day.month)
+
+        if report == "supplies":
+            fingerprint:str = self.fingerprints.get(month, hour_grid, supply_report.MONTH_VALUES_MEASUREMENTS)
+            cups:str = parameters.get("cups")
+            partner:str = parameters.get("partner")
+            partners_hash:str = get_file_hash(COMMUNITY_PARTNERS_FILE_PATH)
+            key:tuple = ("supplies", month, file_format, cups, partner, partners_hash, fingerprint)
+            return self.cache.get(key, lambda: self.get_supplies_report(month, hour_grid, fingerprint, file_format, cups, partner))
+
+        fingerprint:str = self.fingerprints.get(month, hour_grid, FINGERPRINT_MEASUREMENTS)
+        key:tuple = ("compensation", month, file_format, fingerprint)
+        return self.cache.get(key, lambda: self.get_compensation_report(hour_grid, file_format))
+
+    ##
+    # Build the report of the supplies of a month, of a single supply or of the supplies of a partner
+    ##
+    def get_supplies_report(self, month:str, hour_grid:HourGrid, fingerprint:str, file_format:str, cups:str=None, partner:str=None)-> bytes:
+
+        # Registry with all the partners with all their supplies
+        partners_registry = load_partners_registry(COMMUNITY_PARTNERS_FILE_PATH)
+
+        supplies_indexes = None
+        if cups is not None:
+            if cups not in partners_registry.cups_index:
+                raise ReportRequestError(404, f"Supply {cups} not found.")
+            supplies_indexes = [partners_registry.cups_index[cups]]
+        elif partner is not None:
+            # Partners are identified by their DNI, or by their name when they have no DNI
+            supplies_indexes = supply_report.get_partners_supplies(partners_registry).get(partner)
+            if supplies_indexes is None:
+                raise ReportRequestError(404, f"Partner {partner} not found.")
+
+        # The data of the month is shared by the reports of all the supplies and partners
+        supplies_values:dict = self.cache.get(("supplies_values", month, fingerprint), lambda: supply_report.get_month_supplies_values(hour_grid))[0]
+
+        rows:list = supply_report.get_supplies_report_rows(partners_registry, supplies_values, supplies_indexes)
+
+        if file_format == "parquet":
+            return report_files.get_parquet_bytes(supply_report.get_supplies_report_table(rows))
+        if file_format == "json":
+            return json.dumps([dict(zip(supply_report.REPORT_COLUMNS, row)) for row in rows]).encode('utf-8')
+
+        return report_files.get_csv_bytes(supply_report.REPORT_HEADER, rows)
+
+    ##
+    # Build the report with the hourly surplus of the community for every day of a month
+    ##
+    def get_compensation_report(self, hour_grid:HourGrid, file_format:str)-> bytes:
+
+        matrix:np.ndarray = compensation_report.get_day_hour_matrix(hour_grid, compensation_report.get_community_surplus_by_hour(hour_grid))
+
+        if file_format == "parquet":
+            return report_files.get_parquet_bytes(compensation_report.get_compensation_report_table(hour_grid, matrix))
+        if file_format == "json":
+            days:list = []
+            for day_index, day in enumerate(hour_grid.days):
+                day_report:dict = {
+                    "cil": compensation_report.CIL,
+                    "measurement_type": compensation_report.MEASUREMENT_TYPE,
+                    "status": compensation_report.STATUS,
+                    "date": day.strftime("%Y-%m-%d"),
+                }
+                for hour_index, value in enumerate(matrix[day_index]):
+                    day_report[f"hor{hour_index + 1}"] = None if np.isnan(value) else float(value)
+                days.append(day_report)
+            return json.dumps(days).encode('utf-8')
+
+        return report_files.get_csv_bytes(compensation_report.REPORT_HEADER, compensation_report.get_compensation_report_rows(hour_grid, matrix))
+
+##
+# Handler of the requests of the service
+##
+class ReportRequestHandler(BaseHTTPRequestHandler):
+
+    # Service shared by all the requests, set when the server starts
+    service:ReportService = None
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+        match = REQUEST_PATH.match(url.path)
+        if match is None:
+            self.send_error_response(404, "Not found. Use /supplies/yyyy-mm.csv or /compensation/yyyy-mm.csv (also .json and .parquet).")
+            return
+
+        report, month, file_format = match.groups()
+        parameters:dict = {name: values[0] for name, values in parse_qs(url.query).items()}
+
+        try:
+            with pipeline_metrics.stage("request"):
+                content, cached = self.service.get_report(report, month, file_format, parameters)
+        except ReportRequestError as e:
+            self.send_error_response(e.status, str(e))
+            return
+        except Exception as e:
+            logging.error(f"Error serving {self.path}: {e}")
+            self.send_error_response(500, "Error generating the report.")
+            return
+
+        pipeline_metrics.increment("report_cache_hits" if cached else "report_cache_misses")
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[file_format])
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("X-Cache", "HIT" if cached else "MISS")
+        self.end_headers()
+        self.wfile.write(content)
+
+    ##
+    # Send an error with a message as plain text
+    ##
+    def send_error_response(self, status:int, message:str):
+
+        content:bytes = f"{message}\n".encode('utf-8')
+
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    ##
+    # Log the requests into the log of the service instead of the standard error
+    ##
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} - {format % args}")
+
+##
+# Main function
+##
+def main():
+
+    logging.info(f"Process {script_name} started.")
+
+    try:
+
+        args:argparse.Namespace = get_arguments()
+
+        ReportRequestHandler.service = ReportService(args.cache_size, args.fingerprint_ttl)
+
+        server = ThreadingHTTPServer((args.host, args.port), ReportRequestHandler)
+
+        logging.info(f"Serving reports on http://{args.host}:{args.port}.")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logging.info("Service stopped.")
+        finally:
+            server.server_close()
+
+    except Exception as e:
+        logging.error(f"Error: {e}")
+
+    pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
+
+    logging.info(f"Process {script_name} finished.")
+
+if __name__ == "__main__":
+    main()
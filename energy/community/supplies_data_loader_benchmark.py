@@ -0,0 +1,151 @@
+##
+# Benchmark of the script that loads the energy data of the community supplies.
+# It runs the loader against an in-memory InfluxDB seeded with a synthetic community of N supplies
+# and M months of production, prices and consumptions, and reports:
+# - wall time
+# - number of queries
+# - number of write requests and points written
+##
+from datetime import datetime
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+
+# Log only warnings to the console, the loader must not write into its log file during the benchmark
+logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.fake_influxdb import FakeInfluxDBClient
+from common.influxdb_session import set_influxdb_client
+from common.partners_registry import PartnersRegistry
+from common.time_grid import HourGrid, get_month_hour_grid, get_months, get_next_month
+
+import supplies_data_loader_by_month as loader
+
+##
+# Get the arguments of the script
+##
+def get_arguments()-> argparse.Namespace:
+
+    # Function to validate the date format
+    def validate_date(date_str):
+        try:
+            return datetime.strptime(date_str, "%Y-%m")
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Date {date_str} has an invalid format. Use yyyy-mm.")
+
+    # Create an ArgumentParser object
+    parser = argparse.ArgumentParser(description='Benchmark of the community supplies data loader using an in-memory InfluxDB')
+
+    # Define the expected arguments
+    parser.add_argument('--supplies', type=int, default=70, help='Number of supplies of the synthetic community')
+    parser.add_argument('--months', type=int, default=1, help='Number of months to load')
+    parser.add_argument('--start-month', type=validate_date, default=datetime(2023, 1, 1), help='First month to load in "yyyy-mm" format')
+    parser.add_argument('--shard', choices=['month', 'day'], default='month', help='Unit of work loaded at once')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random synthetic data')
+
+    # Parse the command-line arguments
+    return parser.parse_args()
+
+##
+# Build a synthetic community with one supply per partner and betas that add up to one
+##
+def get_synthetic_partners_registry(supplies:int)-> PartnersRegistry:
+
+    partners:list = []
+    for supply_index in range(supplies):
+        partners.append({
+            "name": f"Partner {supply_index + 1}",
+            "dni": f"{supply_index + 1:08d}X",
+            "supplies": [{"cups": f"ES{supply_index + 1:016d}XX", "beta": 1.0 / supplies}]
+        })
+
+    return PartnersRegistry(partners)
+
+##
+# Write synthetic production, prices and consumptions for every hour of a month
+##
+def seed_month(client:FakeInfluxDBClient, hour_grid:HourGrid, partners_registry:PartnersRegistry, random:np.random.Generator):
+
+    hours_count:int = len(hour_grid)
+
+    # Production follows the sun: zero at night and a peak at noon (local time)
+    local_hours:np.ndarray = np.array([local_hour.hour for local_hour in hour_grid.local_hours], dtype=np.float64)
+    production:np.ndarray = np.clip(np.sin((local_hours - 6.0) / 14.0 * np.pi), 0.0, None) * random.uniform(20.0, 40.0, hours_count)
+
+    prices:np.ndarray = random.uniform(40.0, 160.0, hours_count)
+
+    consumption:np.ndarray = random.uniform(0.0, 1.5, (hours_count, len(partners_registry)))
+    surplus:np.ndarray = np.minimum(production[:, np.newaxis] * partners_registry.betas[np.newaxis, :], random.uniform(0.0, 0.5, (hours_count, len(partners_registry))))
+
+    points:list = []
+    for hour_index, influx_hour in enumerate(hour_grid.influx_hours):
+        points.append({"measurement": "energy_production_huawei_hour", "time": influx_hour, "fields": {"inverter-power": float(production[hour_index])}})
+        points.append({"measurement": "omie-daily-prices", "time": influx_hour, "fields": {"price1": float(prices[hour_index]), "price2": float(prices[hour_index])}})
+
+        for supply_index, cups in enumerate(partners_registry.cups):
+            points.append({
+                "measurement": "energy_consumption_datadis",
+                "time": influx_hour,
+                "fields": {
+                    "consumptionKWh": float(consumption[hour_index, supply_index]),
+                    "obtainMethod": "Real",
+                    "surplusEnergyKWh": float(surplus[hour_index, supply_index]),
+                },
+                "tags": {"cups": cups}
+            })
+
+    client.write_points(points)
+
+def main():
+
+    args:argparse.Namespace = get_arguments()
+
+    random:np.random.Generator = np.random.default_rng(args.seed)
+    partners_registry:PartnersRegistry = get_synthetic_partners_registry(args.supplies)
+
+    # The line protocol is not recorded to measure only the loader
+    client:FakeInfluxDBClient = FakeInfluxDBClient(record_lines=False)
+    set_influxdb_client(client)
+
+    last_month:datetime = args.start_month
+    for month_index in range(1, args.months):
+        last_month = get_next_month(last_month)
+    months:list = get_months(args.start_month, last_month)
+
+    seed_start_time:float = time.monotonic()
+    for month_first_day in months:
+        seed_month(client, get_month_hour_grid(month_first_day.year, month_first_day.month), partners_registry, random)
+    seed_seconds:float = time.monotonic() - seed_start_time
+
+    client.reset_counters()
+
+    start_time:float = time.monotonic()
+    hours:int = 0
+    for first_day, last_day in loader.get_shards(months, args.shard):
+        summary:dict = loader.load_supplies_data(first_day, last_day, partners_registry.cups, partners_registry.betas)
+        hours += summary["hours"]
+    seconds:float = time.monotonic() - start_time
+
+    result:dict = {
+        "supplies": args.supplies,
+        "months": args.months,
+        "shard": args.shard,
+        "hours": hours,
+        "seed_seconds": round(seed_seconds, 3),
+        "wall_seconds": round(seconds, 3),
+        "queries": client.query_count,
+        "write_requests": client.write_request_count,
+        "points_written": client.points_written,
+        "points_per_second": round(client.points_written / seconds, 1) if seconds > 0 else None,
+    }
+
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
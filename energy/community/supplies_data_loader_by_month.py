@@ -7,29 +7,40 @@
 # - self consumption
 # - self consumption percentage
 # - utilization percentage
+# Besides the hourly "community_supply" measurement, it keeps up to date the rollups with the sums
+# of every supply by local day ("community_supply_daily") and by month ("community_supply_monthly").
 ##
 from datetime import datetime, timedelta
-import pytz
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import argparse
+import hashlib
 import json
+import numpy as np
 from influxdb import InfluxDBClient
 import logging
 import os
+import sys
+import time
 from dotenv import load_dotenv
+from supplies_metrics import ROLLUP_FIELDS, calculate_supplies_data, sum_supplies_data_by_day
+
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.atomic_files import open_atomic_file
+from common.influxdb_points_writer import InfluxDBPointsWriter
+from common.influxdb_session import get_influxdb_client
+from common import pipeline_metrics
+from common.partners_registry import load_partners_registry
+from common.time_grid import HourGrid, get_hour_grid, get_month_hour_grid, get_months, get_next_month
 
 # Load environment variables from the .env file in the current directory
 load_dotenv()
 
-INFLUXDB_HOST = os.getenv("INFLUXDB_HOST")
-INFLUXDB_PORT = int(os.getenv("INFLUXDB_PORT"))
-INFLUXDB_DATABASE = os.getenv("INFLUXDB_DATABASE")
-INFLUXDB_USER = os.getenv("INFLUXDB_USER")
-INFLUXDB_PASSWORD = os.getenv("INFLUXDB_PASSWORD")
-
 COMMUNITY_PARTNERS_FILE_PATH=os.getenv("COMMUNITY_PARTNERS_FILE_PATH")
 
-# Specify the time zone
-TIMEZONE = pytz.timezone('Europe/Madrid')
+# Number of points written into InfluxDB by request and maximum seconds between writes
+INFLUXDB_WRITE_BATCH_SIZE = int(os.getenv("INFLUXDB_WRITE_BATCH_SIZE", "5000"))
+INFLUXDB_WRITE_FLUSH_INTERVAL = float(os.getenv("INFLUXDB_WRITE_FLUSH_INTERVAL", "10"))
 
 # Get the absolute path of the currently executing script
 script_path = os.path.abspath(__file__)
@@ -40,6 +51,9 @@ script_directory = os.path.dirname(script_path)
 # Get the base name of the script (without extension)
 script_name = os.path.splitext(os.path.basename(script_path))[0]
 
+# Directory where the fingerprints of the inputs used to calculate every hour are stored
+WATERMARKS_DIRECTORY = f"{script_directory}/data"
+
 # Logging configuration
 log_file_path = f"{script_directory}/logs/{script_name}.log"
 log_format = "%(asctime)s - %(levelname)s - %(message)s"
@@ -55,16 +69,15 @@ def get_script_name()-> str:
     # Get the base name of the script (without extension)
     return os.path.splitext(os.path.basename(script_path))[0]
 
-def create_influxdb_client():
-    return InfluxDBClient(host=INFLUXDB_HOST, port=INFLUXDB_PORT, database=INFLUXDB_DATABASE, username=INFLUXDB_USER, password=INFLUXDB_PASSWORD)
-
-def close_influxdb_client(client:InfluxDBClient):
-    client.close()
-
 ##
-# Get the month passed by argument with format YYYY-mm
+# Get the arguments of the script:
+# - month: first month to load with format YYYY-mm
+# - end_month: optional last month to load with format YYYY-mm. If it is not set, only the first month is loaded
+# - shard: unit of work processed by every worker, "month" or "day"
+# - workers: maximum number of processes loading data at the same time
+# - incremental: only recalculate and write the hours whose inputs changed since the previous run
 ##
-def get_month()-> datetime:
+def get_arguments()-> argparse.Namespace:
 
     # Function to validate the date format 
     def validate_date(date_str):
@@ -73,16 +86,57 @@ def get_month()-> datetime:
         except ValueError:          
             raise argparse.ArgumentTypeError(f"Date {date_str} has an invalid format. Use yyyy-mm.")
 
+    # Function to validate the number of workers
+    def validate_workers(workers_str):
+        try:
+            workers:int = int(workers_str)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Workers {workers_str} must be a number.")
+        if workers < 1:
+            raise argparse.ArgumentTypeError(f"Workers {workers_str} must be greater than zero.")
+        return workers
+
     # Create an ArgumentParser object
     parser = argparse.ArgumentParser(description='Script to calculate surplus compensation hourly by month')
 
     # Define the expected arguments
     parser.add_argument('month', type=validate_date, help='Year and month in "yyyy-mm" format')
+    parser.add_argument('end_month', type=validate_date, nargs='?', help='Last year and month in "yyyy-mm" format to load a range of months')
+    parser.add_argument('--shard', choices=['month', 'day'], default='month', help='Unit of work processed by every worker')
+    parser.add_argument('--workers', type=validate_workers, default=os.cpu_count() or 1, help='Maximum number of processes loading data at the same time')
+    parser.add_argument('--incremental', action='store_true', help='Only recalculate and write the hours whose inputs changed since the previous run')
 
     # Parse the command-line arguments
     args = parser.parse_args()
 
-    return args.month
+    if args.end_month is None:
+        args.end_month = args.month
+
+    if args.end_month < args.month:
+        parser.error(f"End month {args.end_month.strftime('%Y-%m')} is before month {args.month.strftime('%Y-%m')}.")
+
+    return args
+
+##
+# Split a list of months into shards of work. Every shard is the list of days it covers (first and last day)
+##
+def get_shards(months:list, shard:str)-> list:
+
+    shards:list = []
+    for month_first_day in months:
+
+        # Determine the last day of the month
+        last_day:datetime = get_next_month(month_first_day) - timedelta(days=1)
+
+        if shard == 'day':
+            current_day:datetime = month_first_day
+            while current_day <= last_day:
+                shards.append((current_day, current_day))
+                current_day += timedelta(days=1)
+        else:
+            shards.append((month_first_day, last_day))
+
+    return shards
 
 ##
 # Transform a datetime into a date in RFC3339 format that InfluxDB can understand
@@ -93,254 +147,414 @@ def get_influx_date(month_date:datetime)-> str:
     return month_date.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 ##
-# Transform the result of a query to a InfluxDB into a float value
-# If there is an error during the transformation, returns a 0.0
+# Get a map with the values of a field by time from an InfluxDB query result.
+# Missing values (None) are returned as 0.0
 ##
-def get_value_as_float(result, field:str)-> float:
+def get_values_by_time(points, field:str)-> dict:
 
-    try:
-        # If nothing is found, return zero
-        if len(result.keys()) == 0:
-            return 0.0
-        
-        # Access the measurement name (it's the first key in the ResultSet)
-        measurement = list(result.keys())[0]
-
-        # Access the data points for that measurement
-        data_points = result[measurement]
-
-        # Iterate through the data points
-        for point in data_points:
-            value = point[field]            
-            return value
-        
-    except Exception as e:
-        logging.error(f"Error extracting the value {field} as float from an InfluxDB query result.", e)
-        raise e
+    values:dict = {}
+    for point in points:
+        value = point[field]
+        values[point["time"]] = float(value) if value is not None else 0.0
+
+    return values
 
 ##
-# Get the production for an hour
+# Get the production for every hour of an interval with a single query
 ##
-def get_production_by_hour(datetime_hour:datetime)-> float:
+def get_production_by_interval(client:InfluxDBClient, first_hour:datetime, last_hour:datetime)-> dict:
 
     try:
-        client = create_influxdb_client()
-
-        query:str = f'SELECT "inverter-power" FROM energy_production_huawei_hour WHERE time = \'{get_influx_date(datetime_hour)}\''
+        query:str = f'SELECT "inverter-power" FROM energy_production_huawei_hour WHERE time >= \'{get_influx_date(first_hour)}\' AND time <= \'{get_influx_date(last_hour)}\''
         result = client.query(query)
 
-        close_influxdb_client(client)
-            
-        return get_value_as_float(result, 'inverter-power')
-    
+        return get_values_by_time(result.get_points(), 'inverter-power')
+
     except Exception as e:
-        logging.error(f"Error getting the production for hour {datetime_hour}.", e)
+        logging.error(f"Error getting the production from {first_hour} to {last_hour}.", e)
         raise e
 
 ##
-# Get the surplus for a supply, given a CUPS, for an hour
+# Get the price of the energy in €kWh for every hour of an interval with a single query
 ##
-def get_supply_surplus_by_hour(datetime_hour:datetime, cups:str)-> float:
+def get_price_by_interval(client:InfluxDBClient, first_hour:datetime, last_hour:datetime)-> dict:
 
     try:
-        client = create_influxdb_client()
-
-        query:str = f'SELECT surplusEnergyKWh FROM energy_consumption_datadis WHERE cups = \'{cups}\' and time = \'{get_influx_date(datetime_hour)}\''
+        query:str = f'SELECT price1 FROM "omie-daily-prices" WHERE time >= \'{get_influx_date(first_hour)}\' AND time <= \'{get_influx_date(last_hour)}\''
         result = client.query(query)
 
-        close_influxdb_client(client)
+        prices_mWh:dict = get_values_by_time(result.get_points(), 'price1')
+
+        return {time: price_mWh / 1000 for time, price_mWh in prices_mWh.items()}
 
-        return get_value_as_float(result, 'surplusEnergyKWh')
-    
     except Exception as e:
-        logging.error(f"Error getting surplus for cups {cups} and hour {datetime_hour}.", e)
+        logging.error(f"Error getting energy prices from {first_hour} to {last_hour}.", e)
         raise e
 
 ##
-# Get the final consumption for a supply, given a CUPS, for an hour
+# Get the surplus and the final consumption of every supply for every hour of an interval with a single query.
+# Returns a map by CUPS with the maps of surplus and final consumption by time
 ##
-def get_supply_final_consumption_by_hour(datetime_hour:datetime, cups:str)-> float:
+def get_supplies_consumption_by_interval(client:InfluxDBClient, first_hour:datetime, last_hour:datetime)-> dict:
 
     try:
-        client = create_influxdb_client()
-
-        query:str = f'SELECT consumptionKWh FROM energy_consumption_datadis WHERE cups = \'{cups}\' and time = \'{get_influx_date(datetime_hour)}\''
+        query:str = f'SELECT surplusEnergyKWh, consumptionKWh FROM energy_consumption_datadis WHERE time >= \'{get_influx_date(first_hour)}\' AND time <= \'{get_influx_date(last_hour)}\' GROUP BY cups'
         result = client.query(query)
 
-        close_influxdb_client(client)
+        supplies_consumption:dict = {}
+        for (measurement, tags), points in result.items():
+            points = list(points)
+            supplies_consumption[tags["cups"]] = {
+                "surplus": get_values_by_time(points, 'surplusEnergyKWh'),
+                "consumption_final": get_values_by_time(points, 'consumptionKWh'),
+            }
+
+        return supplies_consumption
 
-        return get_value_as_float(result, 'consumptionKWh')
-    
     except Exception as e:
-        logging.error(f"Error getting final consumption for cups {cups} and hour {datetime_hour}.", e)
+        logging.error(f"Error getting supplies consumption from {first_hour} to {last_hour}.", e)
         raise e
 
 ##
-# Get the price of the energy in €kWh for an hour
+# Prefetch all the data needed to calculate the supplies data for the hours of a grid.
+# It runs one range query by source measurement and returns the values indexed by hour and CUPS:
+# - hours: list of hours in InfluxDB format
+# - cups: list of CUPS
+# - production: array with the total production by hour
+# - price: array with the price in €kWh by hour
+# - surplus: matrix with the surplus by hour and CUPS
+# - consumption_final: matrix with the final consumption by hour and CUPS
 ##
-def get_price_by_hour(datetime_hour:datetime)-> float:
+def prefetch_supplies_data(hour_grid:HourGrid, cups_list:list)-> dict:
 
-    try:
-        client = create_influxdb_client()
+    client = get_influxdb_client()
 
-        query:str = f'SELECT price1 FROM "omie-daily-prices" WHERE time = \'{get_influx_date(datetime_hour)}\''
-        result = client.query(query)
+    first_hour:datetime = hour_grid.utc_hours[0]
+    last_hour:datetime = hour_grid.utc_hours[-1]
 
-        close_influxdb_client(client)
+    production_by_time:dict = get_production_by_interval(client, first_hour, last_hour)
+    price_by_time:dict = get_price_by_interval(client, first_hour, last_hour)
+    supplies_consumption:dict = get_supplies_consumption_by_interval(client, first_hour, last_hour)
 
-        price_mWh:float = get_value_as_float(result, 'price1')
+    hours:list = hour_grid.influx_hours
 
-        return price_mWh / 1000
-    
-    except Exception as e:
-        logging.error(f"Error getting energy price for hour {datetime_hour}.", e)
-        raise e
+    # Supplies without data in the interval get zero surplus and consumption
+    empty_supply_consumption:dict = {"surplus": {}, "consumption_final": {}}
+    consumption_by_cups:list = [supplies_consumption.get(cups, empty_supply_consumption) for cups in cups_list]
+
+    return {
+        "hours": hours,
+        "cups": cups_list,
+        "production": np.array([production_by_time.get(hour, 0.0) for hour in hours], dtype=np.float64),
+        "price": np.array([price_by_time.get(hour, 0.0) for hour in hours], dtype=np.float64),
+        "surplus": np.array([[consumption["surplus"].get(hour, 0.0) for consumption in consumption_by_cups] for hour in hours], dtype=np.float64).reshape(len(hours), len(cups_list)),
+        "consumption_final": np.array([[consumption["consumption_final"].get(hour, 0.0) for consumption in consumption_by_cups] for hour in hours], dtype=np.float64).reshape(len(hours), len(cups_list)),
+    }
 
 ##
-# Insert collected data for a supply in a InfluxDB measurement
-##
-def insert_supply_data(time, supply_data):
-
-    client = create_influxdb_client()
-
-    time = get_influx_date(time)
-    
-    supply_point = [
-        {
-            "measurement": "community_supply",
-            "time": time,
-            "fields": {
-                "production": supply_data["production"],
-                "surplus": supply_data["surplus"],
-                "consumption_final": supply_data["consumption_final"],
-                "self_consumption": supply_data["self_consumption"],
-                "self_consumption_percentage": supply_data["self_consumption_percentage"],
-                "utilization_percentage": supply_data["utilization_percentage"],
-                "compensation": supply_data["compensation"],
-            },
-            "tags": {
-                "cups": supply_data['cups'],
-                "beta": supply_data["beta"],
-            }
+# Get a fingerprint for every hour of the inputs used to calculate the supplies data of that hour:
+# production, price, and CUPS, beta, surplus and final consumption of every supply
+##
+def get_hours_fingerprints(supplies_data:dict, betas:np.ndarray)-> list:
+
+    # The supplies and their betas are the same for all the hours
+    supplies_key:bytes = json.dumps([supplies_data["cups"], np.asarray(betas).tolist()]).encode('utf-8')
+
+    hours_inputs:np.ndarray = np.column_stack((supplies_data["production"], supplies_data["price"], supplies_data["surplus"], supplies_data["consumption_final"]))
+
+    return [hashlib.sha1(supplies_key + hour_inputs.tobytes()).hexdigest() for hour_inputs in hours_inputs]
+
+##
+# Get the path of the file with the fingerprints of the inputs of every hour of a month
+##
+def get_watermarks_file_path(month_first_day:datetime)-> str:
+    return f"{WATERMARKS_DIRECTORY}/supplies_watermarks_{month_first_day.strftime('%Y-%m')}.json"
+
+##
+# Load the fingerprints of the inputs of every hour of a month stored by previous runs
+##
+def load_watermarks(month_first_day:datetime)-> dict:
+
+    file_path:str = get_watermarks_file_path(month_first_day)
+
+    if not os.path.exists(file_path):
+        return {}
+
+    with open(file_path, 'r') as watermarks_file:
+        return json.load(watermarks_file)
+
+##
+# Store the fingerprints of the inputs of every hour of a month
+##
+def save_watermarks(month_first_day:datetime, watermarks:dict):
+
+    file_path:str = get_watermarks_file_path(month_first_day)
+
+    with open_atomic_file(file_path) as watermarks_file:
+        watermarks_file.write(json.dumps(watermarks, sort_keys=True).encode('utf-8'))
+
+##
+# Build the InfluxDB point with the collected data for a supply for an hour in RFC3339 format
+##
+def get_supply_point(influx_hour:str, supply_data)-> dict:
+
+    return {
+        "measurement": "community_supply",
+        "time": influx_hour,
+        "fields": {
+            "production": supply_data["production"],
+            "surplus": supply_data["surplus"],
+            "consumption_final": supply_data["consumption_final"],
+            "self_consumption": supply_data["self_consumption"],
+            "self_consumption_percentage": supply_data["self_consumption_percentage"],
+            "utilization_percentage": supply_data["utilization_percentage"],
+            "compensation": supply_data["compensation"],
+        },
+        "tags": {
+            "cups": supply_data['cups'],
+            "beta": supply_data["beta"],
         }
-    ]
-    
-    client.write_points(supply_point)
-        
-    close_influxdb_client(client)
+    }
 
+##
+# Build the InfluxDB point with the sums of a supply for a period (day or month) of a rollup measurement
+##
+def get_supply_rollup_point(measurement:str, influx_time:str, cups:str, beta:float, supply_sums:dict)-> dict:
+
+    return {
+        "measurement": measurement,
+        "time": influx_time,
+        "fields": supply_sums,
+        "tags": {
+            "cups": cups,
+            "beta": beta,
+        }
+    }
 
 ##
-# Main function
+# Build the rollup points of all the supplies for a period (day or month)
 ##
-def main():
+def get_supplies_rollup_points(measurement:str, influx_time:str, cups_list:list, betas:np.ndarray, sums:dict)-> list:
 
-    script_name = get_script_name()
+    points:list = []
+    for cups_index, cups in enumerate(cups_list):
+        supply_sums:dict = {field: float(sums[field][cups_index]) for field in ROLLUP_FIELDS}
+        points.append(get_supply_rollup_point(measurement, influx_time, cups, float(betas[cups_index]), supply_sums))
 
-    logging.info(f"Process {script_name} started.")
+    return points
 
-    try:
+##
+# Load the data of all the supplies for the days between two days, both included.
+# If previous watermarks are received, only the hours whose inputs fingerprint changed are written, and only
+# the days with changed hours are written in the daily rollup.
+# Returns a summary with the number of hours and points written, the seconds spent, the new watermarks and
+# the sums of every supply by day, needed to build the monthly rollup
+##
+def load_supplies_data(first_day:datetime, last_day:datetime, cups_list:list, betas:np.ndarray, previous_watermarks:dict=None)-> dict:
 
-         # Open the JSON file for reading with all the partners with all their supplies
-        with open(COMMUNITY_PARTNERS_FILE_PATH, 'r') as partners_file:
-            partners = json.load(partners_file)
+    start_time:float = time.monotonic()
 
-        month_first_day:datetime = get_month()
+    logging.info(f"Loading days from {first_day.strftime('%Y-%m-%d')} to {last_day.strftime('%Y-%m-%d')}.")
 
-        # Iterate by every day of the month
-        month:int = month_first_day.month
-        year:int = month_first_day.year
-        
-        # Determine the last day of the month
-        if month == 12:
-            last_day:datetime = datetime(year + 1, 1, 1) - timedelta(days=1)
+    # Exact hours of the local days of the period, taking into account the changes of time
+    hour_grid:HourGrid = get_hour_grid(first_day, last_day)
+
+    # Get all the data of the period with one query by source measurement
+    with pipeline_metrics.stage("influxdb_read"):
+        supplies_data:dict = prefetch_supplies_data(hour_grid, cups_list)
+
+    with pipeline_metrics.stage("calculation"):
+        hours_fingerprints:list = get_hours_fingerprints(supplies_data, betas)
+
+        # Select the hours to calculate: all of them or only the ones whose inputs changed
+        if previous_watermarks is None:
+            hours_indexes:np.ndarray = np.arange(len(hour_grid))
         else:
-            last_day:datetime = datetime(year, month + 1, 1) - timedelta(days=1)
-        
-        # Iterate through the days of the month
-        current_day:datetime = month_first_day
-        while current_day <= last_day:
+            hours_indexes:np.ndarray = np.array([hour_index for hour_index, hour in enumerate(supplies_data["hours"]) if previous_watermarks.get(hour) != hours_fingerprints[hour_index]], dtype=np.int64)
 
-            logging.info(f"Day: {current_day}.")
-            
-            # Iterate by every hour of the day from 0 to 23
-            for current_hour in range(24):
+        logging.info(f"Hours to write: {len(hours_indexes)}/{len(hour_grid)}.")
 
-                logging.info(f"Hour: {current_hour}.")
+        # Calculate the data of all the supplies for all the hours at once.
+        # Unchanged hours are calculated too because the rollups of their days need them
+        supplies_metrics:dict = calculate_supplies_data(supplies_data["production"], supplies_data["price"], supplies_data["surplus"], supplies_data["consumption_final"], betas)
 
-                datetime_hour = current_day + timedelta(hours=current_hour)
+        # Sums of every supply by day, and days with changed hours
+        daily_sums:dict = sum_supplies_data_by_day(supplies_metrics, hour_grid.day_offsets)
+        days_indexes:np.ndarray = np.unique(hour_grid.hour_days[hours_indexes])
 
-                # Set Madrid timezone to date
-                localized_datetime_hour:datetime = TIMEZONE.localize(datetime_hour)
+    # Points are buffered and written in batches
+    with pipeline_metrics.stage("influxdb_write"), InfluxDBPointsWriter(get_influxdb_client(), batch_size=INFLUXDB_WRITE_BATCH_SIZE, flush_interval=INFLUXDB_WRITE_FLUSH_INTERVAL) as writer:
 
-                # Convert localized date to UTC
-                utc_datetime_hour:datetime = localized_datetime_hour.astimezone(pytz.utc)
+        # Iterate through the selected hours of the period
+        for hour_index in hours_indexes:
 
-                # Get total production
-                production_total:float = get_production_by_hour(utc_datetime_hour)
-                logging.debug(f"Production total: {production_total}.")
+            influx_hour:str = hour_grid.influx_hours[hour_index]
 
-                # Get the price for that hour
-                price:float = get_price_by_hour(utc_datetime_hour)
-                logging.debug(f"Price: {price}.")                
+            logging.debug(f"Hour: {influx_hour}.")
 
-                # Loop the list of partners
-                for partner in partners:
-                    supplies = partner["supplies"]
-                    
-                    # Loop the list of supplies by partner
-                    for supply in supplies:
+            # Loop the list of supplies of all the partners
+            for cups_index, cups in enumerate(cups_list):
 
-                        supply_data = {}
+                supply_data = {"cups": cups, "beta": float(betas[cups_index])}
+                for field, values in supplies_metrics.items():
+                    supply_data[field] = float(values[hour_index, cups_index])
 
-                        cups = supply["cups"]
-                        supply_data["cups"] = cups                        
+                logging.debug(f"Supply data {supply_data}.")
 
-                        beta = supply["beta"]
-                        supply_data["beta"] = beta                                                                    
+                writer.write(get_supply_point(influx_hour, supply_data))
 
-                        # Calculate production by multiplying beta to production
-                        production_supply:float = production_total * beta
-                        supply_data["production"] = production_supply
-                            
-                        # Get supply surplus
-                        surplus_supply:float = get_supply_surplus_by_hour(utc_datetime_hour, cups)
-                        supply_data["surplus"] = surplus_supply
+        # Daily rollup of the days with changed hours, every day starts at its local midnight
+        for day_index in days_indexes:
+            influx_day:str = hour_grid.influx_hours[hour_grid.day_offsets[day_index]]
+            writer.write_all(get_supplies_rollup_points("community_supply_daily", influx_day, cups_list, betas, {field: sums[day_index] for field, sums in daily_sums.items()}))
 
-                        # Calculate compensation by multiplying surplus by price
-                        compensation:float = surplus_supply * price
-                        supply_data["compensation"] = compensation
+    summary:dict = {
+        "first_day": first_day.strftime('%Y-%m-%d'),
+        "last_day": last_day.strftime('%Y-%m-%d'),
+        "hours": len(hours_indexes),
+        "points": writer.points_flushed,
+        "seconds": time.monotonic() - start_time,
+        "watermarks": dict(zip(supplies_data["hours"], hours_fingerprints)),
+        "changed_days": len(days_indexes),
+        "daily_sums": daily_sums,
+    }
 
-                        # Get supply final consumption
-                        consumption_final_supply:float = get_supply_final_consumption_by_hour(utc_datetime_hour, cups)
-                        supply_data["consumption_final"] = consumption_final_supply
+    logging.info(f"Loaded days from {summary['first_day']} to {summary['last_day']}: {summary['points']} points written in {summary['seconds']:.2f} seconds.")
 
-                        # Get supply self consumption
-                        self_consumption_supply:float = production_supply - surplus_supply
-                        supply_data["self_consumption"] = self_consumption_supply
+    return summary
 
-                        # Calculate supply self consumption percentage
-                        self_consumption_percentage_supply:float = 0.0
-                        if (self_consumption_supply + consumption_final_supply) > 0.0:
-                            self_consumption_percentage_supply = self_consumption_supply / (self_consumption_supply + consumption_final_supply)
-                        supply_data["self_consumption_percentage"] = self_consumption_percentage_supply
+##
+# Write the monthly rollup of all the supplies adding up the daily sums of the shards of a month.
+# The shards must cover all the days of the month. Returns the number of points written
+##
+def load_supplies_monthly_rollup(month_first_day:datetime, month_summaries:list, cups_list:list, betas:np.ndarray)-> int:
+
+    month_sums:dict = {field: np.zeros(len(cups_list), dtype=np.float64) for field in ROLLUP_FIELDS}
+    for summary in month_summaries:
+        for field in ROLLUP_FIELDS:
+            month_sums[field] += summary["daily_sums"][field].sum(axis=0)
+
+    # The month starts at the local midnight of its first day
+    influx_month:str = get_month_hour_grid(month_first_day.year, month_first_day.month).influx_hours[0]
 
-                        # Calculate utilization percentage
-                        utilization_percentage:float = 0.0
-                        if (self_consumption_supply + surplus_supply) > 0.0 :
-                            utilization_percentage = self_consumption_supply / (self_consumption_supply + surplus_supply)
-                        supply_data["utilization_percentage"] = utilization_percentage
+    with pipeline_metrics.stage("influxdb_write"), InfluxDBPointsWriter(get_influxdb_client(), batch_size=INFLUXDB_WRITE_BATCH_SIZE, flush_interval=INFLUXDB_WRITE_FLUSH_INTERVAL) as writer:
+        writer.write_all(get_supplies_rollup_points("community_supply_monthly", influx_month, cups_list, betas, month_sums))
 
-                        logging.info(f"Supply data {supply_data}.")
+    logging.info(f"Monthly rollup of {month_first_day.strftime('%Y-%m')} written: {writer.points_flushed} points.")
 
-                        insert_supply_data(utc_datetime_hour, supply_data)
-                
-            current_day += timedelta(days=1)
+    return writer.points_flushed
+
+##
+# Load the data of all the supplies for the days between two days in a worker process.
+# Returns the summary of the load and the metrics recorded by the worker.
+##
+def load_supplies_data_in_worker(first_day:datetime, last_day:datetime, cups_list:list, betas:np.ndarray, previous_watermarks:dict=None)-> tuple:
+
+    # A worker can load many shards, only the metrics of this shard are returned
+    pipeline_metrics.reset_metrics()
+
+    summary:dict = load_supplies_data(first_day, last_day, cups_list, betas, previous_watermarks)
+
+    return summary, pipeline_metrics.get_metrics()
+
+##
+# Main function
+##
+def main():
+
+    script_name = get_script_name()
+
+    logging.info(f"Process {script_name} started.")
+
+    try:
+
+        # Registry with all the partners with all their supplies
+        partners_registry = load_partners_registry(COMMUNITY_PARTNERS_FILE_PATH)
+
+        args:argparse.Namespace = get_arguments()
+
+        # List of CUPS and betas of all the supplies of all the partners
+        cups_list:list = partners_registry.cups
+        betas:np.ndarray = partners_registry.betas
+
+        months:list = get_months(args.month, args.end_month)
+        shards:list = get_shards(months, args.shard)
+        workers:int = min(args.workers, len(shards))
+
+        # Fingerprints of the inputs used by previous runs, by month
+        watermarks:dict = {month_first_day: load_watermarks(month_first_day) for month_first_day in months}
+
+        # Function to get the previous watermarks of a shard, only needed in incremental mode
+        def get_previous_watermarks(first_day:datetime):
+            if not args.incremental:
+                return None
+            return watermarks[datetime(first_day.year, first_day.month, 1)]
+
+        logging.info(f"Loading {len(shards)} shards by {args.shard} with {workers} workers.")
+
+        start_time:float = time.monotonic()
+        summaries:list = []
+        failed_shards:list = []
+
+        if workers == 1:
+            for first_day, last_day in shards:
+                try:
+                    summaries.append(load_supplies_data(first_day, last_day, cups_list, betas, get_previous_watermarks(first_day)))
+                except Exception as e:
+                    logging.error(f"Error loading days from {first_day} to {last_day}: {e}")
+                    failed_shards.append(first_day)
+        else:
+            # Every shard is loaded in its own process, with at most "workers" processes running at the same time
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures:dict = {executor.submit(load_supplies_data_in_worker, first_day, last_day, cups_list, betas, get_previous_watermarks(first_day)): first_day for first_day, last_day in shards}
+
+                for future in as_completed(futures):
+                    first_day:datetime = futures[future]
+                    try:
+                        summary, worker_metrics = future.result()
+                        summaries.append(summary)
+                        pipeline_metrics.merge_metrics(worker_metrics)
+                        logging.info(f"Progress: {len(summaries) + len(failed_shards)}/{len(shards)} shards finished.")
+                    except Exception as e:
+                        logging.error(f"Error loading shard starting on {first_day}: {e}")
+                        failed_shards.append(first_day)
+
+        # Monthly rollup of the months whose shards were all loaded and that have changed days.
+        # The fingerprints of the inputs of a month are stored only once its rollup is up to date, otherwise
+        # the next incremental run would find no changes and would not write the rollup again
+        failed_months:set = {datetime(first_day.year, first_day.month, 1) for first_day in failed_shards}
+        for month_first_day in months:
+            month_summaries:list = [summary for summary in summaries if summary["first_day"].startswith(month_first_day.strftime('%Y-%m'))]
+
+            if month_first_day in failed_months:
+                logging.error(f"Monthly rollup of {month_first_day.strftime('%Y-%m')} not updated: some days failed.")
+                continue
+
+            if sum(summary["changed_days"] for summary in month_summaries) > 0:
+                try:
+                    load_supplies_monthly_rollup(month_first_day, month_summaries, cups_list, betas)
+                except Exception as e:
+                    logging.error(f"Monthly rollup of {month_first_day.strftime('%Y-%m')} not updated: {e}")
+                    continue
+
+            for summary in month_summaries:
+                watermarks[month_first_day].update(summary["watermarks"])
+            save_watermarks(month_first_day, watermarks[month_first_day])
+
+        # Summary of the whole process
+        logging.info(f"Shards loaded: {len(summaries)}/{len(shards)}.")
+        logging.info(f"Hours calculated: {sum(summary['hours'] for summary in summaries)}.")
+        logging.info(f"Points written: {sum(summary['points'] for summary in summaries)}.")
+        logging.info(f"Elapsed seconds: {time.monotonic() - start_time:.2f}.")
+        for first_day in sorted(failed_shards):
+            logging.error(f"Failed shard starting on {first_day.strftime('%Y-%m-%d')}.")
 
     except Exception as e:
         logging.error("Error:", e)    
 
+    pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
+
     logging.info(f"Process {script_name} finished.")
 
 if __name__ == "__main__":
-    main()    
\ No newline at end of file
+    main()
@@ -0,0 +1,86 @@
+##
+# Vectorized calculation of the energy data of the community supplies.
+# All the values of a period are calculated at once using matrices of hours x supplies:
+# - production
+# - compensation
+# - self consumption
+# - self consumption percentage
+# - utilization percentage
+# and the daily sums used to maintain the rollups of the community supplies
+##
+import numpy as np
+
+##
+# Divide two arrays element by element returning 0.0 where the denominator is not greater than zero
+##
+def safe_divide(numerator:np.ndarray, denominator:np.ndarray)-> np.ndarray:
+
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+
+    result:np.ndarray = np.zeros(np.broadcast(numerator, denominator).shape, dtype=np.float64)
+
+    return np.divide(numerator, denominator, out=result, where=denominator > 0.0)
+
+##
+# Calculate the self consumption percentage: self consumption / (self consumption + final consumption)
+##
+def get_self_consumption_percentage(self_consumption:np.ndarray, consumption_final:np.ndarray)-> np.ndarray:
+    return safe_divide(self_consumption, np.add(self_consumption, consumption_final))
+
+##
+# Calculate the utilization percentage: self consumption / (self consumption + surplus)
+##
+def get_utilization_percentage(self_consumption:np.ndarray, surplus:np.ndarray)-> np.ndarray:
+    return safe_divide(self_consumption, np.add(self_consumption, surplus))
+
+##
+# Calculate all the supplies data for a period in one vectorized pass.
+# Receives:
+# - production_total: total production by hour (hours)
+# - price: price of the energy in €kWh by hour (hours)
+# - surplus: surplus by hour and supply (hours x supplies)
+# - consumption_final: final consumption by hour and supply (hours x supplies)
+# - betas: distribution coefficient by supply (supplies)
+# Returns a map with a matrix (hours x supplies) for every field of the "community_supply" measurement
+##
+def calculate_supplies_data(production_total:np.ndarray, price:np.ndarray, surplus:np.ndarray, consumption_final:np.ndarray, betas:np.ndarray)-> dict:
+
+    production_total = np.asarray(production_total, dtype=np.float64)
+    price = np.asarray(price, dtype=np.float64)
+    surplus = np.asarray(surplus, dtype=np.float64)
+    consumption_final = np.asarray(consumption_final, dtype=np.float64)
+    betas = np.asarray(betas, dtype=np.float64)
+
+    # Calculate production by multiplying beta to production
+    production:np.ndarray = np.outer(production_total, betas)
+
+    # Calculate compensation by multiplying surplus by price
+    compensation:np.ndarray = surplus * price[:, np.newaxis]
+
+    # Calculate self consumption
+    self_consumption:np.ndarray = production - surplus
+
+    return {
+        "production": production,
+        "surplus": surplus,
+        "consumption_final": consumption_final,
+        "self_consumption": self_consumption,
+        "self_consumption_percentage": get_self_consumption_percentage(self_consumption, consumption_final),
+        "utilization_percentage": get_utilization_percentage(self_consumption, surplus),
+        "compensation": compensation,
+    }
+
+# Fields of the "community_supply" measurement that are added up in the daily and monthly rollups
+ROLLUP_FIELDS:tuple = ("consumption_final", "surplus", "self_consumption", "production", "compensation")
+
+##
+# Add up the hourly supplies data by day.
+# Receives the map of matrices (hours x supplies) returned by calculate_supplies_data and the position
+# of the first hour of every day plus the number of hours (see HourGrid.day_offsets).
+# Returns a map with a matrix (days x supplies) for every rollup field
+##
+def sum_supplies_data_by_day(supplies_data:dict, day_offsets:np.ndarray)-> dict:
+
+    # Every day has at least 23 hours, so no slice of the reduction is empty
+    return {field: np.add.reduceat(supplies_data[field], day_offsets[:-1], axis=0) for field in ROLLUP_FIELDS}
@@ -2,17 +2,22 @@
 # Script to query Datadis to retrieve consumptions for all the CUPS by month
 ##
 import requests
-import json
 import random
 import string
 import argparse
 from datetime import datetime
 import pytz
-from influxdb import InfluxDBClient
 import logging
 import os
+import sys
 from dotenv import load_dotenv
 
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common import pipeline_metrics
+from common.influxdb_session import get_influxdb_client
+from common.partners_registry import load_partners_registry
+
 # Load environment variables from the .env file in the current directory
 load_dotenv()
 
@@ -25,12 +30,6 @@ DATADIS_BASE_URL = os.getenv("DATADIS_BASE_URL")
 DATADIS_LOGIN_URL = DATADIS_BASE_URL + "/nikola-auth/tokens/login"
 DATADIS_GET_CONSUMPTIONS_URL = DATADIS_BASE_URL + "/api-private/api/get-consumption-data"
 
-INFLUXDB_HOST = os.getenv("INFLUXDB_HOST")
-INFLUXDB_PORT = int(os.getenv("INFLUXDB_PORT"))
-INFLUXDB_DATABASE = os.getenv("INFLUXDB_DATABASE")
-INFLUXDB_USER = os.getenv("INFLUXDB_USER")
-INFLUXDB_PASSWORD = os.getenv("INFLUXDB_PASSWORD")
-
 COMMUNITY_PARTNERS_FILE_PATH=os.getenv("COMMUNITY_PARTNERS_FILE_PATH")
 
 # Specify the time zone
@@ -106,6 +105,7 @@ def get_token():
     body += f'--{boundary}--\r\n'
 
     response = requests.post(DATADIS_LOGIN_URL, data=body, headers=headers)
+    pipeline_metrics.record_http_response(response)
     if response.status_code == 200:
         return response.text
     else:
@@ -139,7 +139,7 @@ def get_influx_date(date, time):
 # Receive a list of consumptions by month for a supply and insert the data into an InfluxDB
 def insert_into_influxdb(supply_consumptions):
 
-    client = InfluxDBClient(host=INFLUXDB_HOST, port=INFLUXDB_PORT, database=INFLUXDB_DATABASE, username=INFLUXDB_USER, password=INFLUXDB_PASSWORD)    
+    client = get_influxdb_client()
     
     for supply_consumption in supply_consumptions:
 
@@ -161,8 +161,6 @@ def insert_into_influxdb(supply_consumptions):
         ]
         
         client.write_points(consumption_point)
-        
-    client.close()
 
 # Loads the consumption of all the partners of the community for a month
 def load_consumption(token, month):
@@ -182,30 +180,31 @@ def load_consumption(token, month):
                 "authorizedNif": ""
             }
 
-    # Open the JSON file for reading with all the partners with all their supplies
-    with open(COMMUNITY_PARTNERS_FILE_PATH, 'r') as partners_file:
-        partners = json.load(partners_file)
+    # Registry with all the partners with all their supplies
+    partners_registry = load_partners_registry(COMMUNITY_PARTNERS_FILE_PATH)
 
     # Loop the list of partners
-    for partner in partners:
-        dni = partner["dni"]
-        supplies = partner["supplies"]    
+    for partner_index in range(partners_registry.partners_count()):
+        dni = partners_registry.partner_dnis[partner_index]
         
         # Loop the list of supplies by partner
-        for supply in supplies:
-            cups = supply["cups"]
+        for supply_index in partners_registry.partner_supplies(partner_index):
+            cups = partners_registry.cups[supply_index]
             
             logging.info(f"Cups: {cups}")
 
             query_params["cups"] = cups
             query_params["authorizedNif"] = dni
 
-            response = requests.get(DATADIS_GET_CONSUMPTIONS_URL, headers=headers, params=query_params)
+            with pipeline_metrics.stage("download"):
+                response = requests.get(DATADIS_GET_CONSUMPTIONS_URL, headers=headers, params=query_params)
+            pipeline_metrics.record_http_response(response)
 
             if response.status_code == 200:
-                insert_into_influxdb(response.json())        
+                with pipeline_metrics.stage("influxdb_write"):
+                    insert_into_influxdb(response.json())
             else:
-                logging.error(f"Failed to fetch data for cups {cups} of partner {partner['name']}. Error code {response.status_code} Reason: {response.text}")
+                logging.error(f"Failed to fetch data for cups {cups} of partner {partners_registry.partner_names[partner_index]}. Error code {response.status_code} Reason: {response.text}")
     
 def main():
 
@@ -217,13 +216,16 @@ def main():
 
         month = get_month()
 
-        token = get_token()            
+        with pipeline_metrics.stage("login"):
+            token = get_token()
         
         load_consumption(token, month)                    
 
     except Exception as e:
         logging.error("Error:", e)        
 
+    pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
+
     logging.info(f"Process {script_name} finished.")
 
 if __name__ == "__main__":
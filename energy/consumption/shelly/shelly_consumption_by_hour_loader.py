@@ -1,7 +1,6 @@
 ##
 # Script to load hourly consumption downloading a CSV using the Shelly API and storing the results in a InfluxDB
 ##
-from influxdb import InfluxDBClient
 import csv
 import requests
 from requests.auth import HTTPBasicAuth
@@ -9,8 +8,14 @@ from datetime import datetime
 import pytz
 import logging
 import os
+import sys
 from dotenv import load_dotenv
 
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common import pipeline_metrics
+from common.influxdb_session import get_influxdb_client, close_influxdb_client
+
 # Load environment variables from the .env file in the current directory
 load_dotenv()
 
@@ -20,13 +25,6 @@ SHELLY_PASSWORD=os.getenv("SHELLY_PASSWORD")
 SHELLY_GET_EMETER_0_DATA = "/emeter/0/em_data.csv"
 SHELLY_NAME = os.getenv("SHELLY_NAME")
 
-# InfluxDB connection settings
-INFLUXDB_HOST = os.getenv("INFLUXDB_HOST")
-INFLUXDB_PORT = int(os.getenv("INFLUXDB_PORT"))
-INFLUXDB_DATABASE = os.getenv("INFLUXDB_DATABASE")
-INFLUXDB_USER = os.getenv("INFLUXDB_USER")
-INFLUXDB_PASSWORD = os.getenv("INFLUXDB_PASSWORD")
-
 BASE_PATH=os.getenv("BASE_PATH")
 
 # Specify the time zone
@@ -55,7 +53,7 @@ def getCsvFilePath():
 
 # Connect to InfluxDB
 def connectToInfluxDB():
-    return InfluxDBClient(host=INFLUXDB_HOST, port=INFLUXDB_PORT, username=INFLUXDB_USER, password=INFLUXDB_PASSWORD, database=INFLUXDB_DATABASE)
+    return get_influxdb_client()
 
 # Download CSV file from Shelly API
 def downloadShellyDataFile():    
@@ -65,6 +63,7 @@ def downloadShellyDataFile():
 
     # Send a GET request to the API
     response = requests.get(api_url, auth=HTTPBasicAuth(SHELLY_USERNAME, SHELLY_PASSWORD))
+    pipeline_metrics.record_http_response(response)
 
     # Check if the request was successful (status code 200)
     if response.status_code == 200:
@@ -131,7 +130,7 @@ def readShellyDataAndWriteIntoDb(client):
 
 # Close the InfluxDB connection
 def closeInfluxDbConnection(client):
-    client.close()
+    close_influxdb_client()
 
 # Check if the file exists before attempting to remove it
 def deleteShellyDataFile():
@@ -145,11 +144,15 @@ def deleteShellyDataFile():
 
 def main():
 
-    downloadShellyDataFile()
+    with pipeline_metrics.stage("download"):
+        downloadShellyDataFile()
 
     client = connectToInfluxDB()
 
-    readShellyDataAndWriteIntoDb(client)
+    with pipeline_metrics.stage("influxdb_write"):
+        readShellyDataAndWriteIntoDb(client)
+
+    pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
 
     closeInfluxDbConnection(client)
 
@@ -0,0 +1,73 @@
+##
+# Parser of the OMIE "marginalpdbc" files, with the hourly marginal prices of the day-ahead market.
+# Files are parsed directly from the downloaded bytes, without writing them to disk.
+# Format of the files:
+# - a header line
+# - one line by hour: year;month;day;hour;price1;price2;
+# - a final line with "*"
+##
+import csv
+import io
+import logging
+from datetime import datetime
+
+MEASUREMENT = "omie-daily-prices"
+
+# Function to parse the hourly prices of the content of a file. Returns a list of (datetime, price1, price2)
+def parsePrices(content):
+
+    reader = csv.reader(io.TextIOWrapper(io.BytesIO(content), encoding='latin-1', newline=''), delimiter=';')
+    next(reader, None)  # Skip the header row
+
+    prices = []
+    for row in reader:
+        # Lines that are not hours, like the final "*", are skipped
+        if len(row) < 6 or not row[0].strip().isdigit():
+            continue
+
+        # Extract the first four fields and parse them into a datetime object
+        year, month, day, hour = map(int, row[0:4])
+        date = datetime(year, month, day, hour-1)
+
+        # Extract the other two fields
+        price1, price2 = map(float, row[4:6])
+
+        prices.append((date, price1, price2))
+
+        # Prices are stored by local hour of the day, the 25th hour of the change to winter time does not fit
+        if (hour == 24):
+            break
+
+    return prices
+
+# Function to build the InfluxDB point of the prices of an hour
+def getPricePoint(date, price1, price2):
+    return {
+        "measurement": MEASUREMENT,
+        "time": date,
+        "fields": {
+            "price1": price1,
+            "price2": price2,
+        }
+    }
+
+# Function to build the InfluxDB points of the prices of all the hours of a file
+def getPricePoints(prices):
+    return [getPricePoint(date, price1, price2) for date, price1, price2 in prices]
+
+# Function to describe the prices of a file in a single line for the logs
+def getPricesSummary(prices):
+    if not prices:
+        return "no hours"
+
+    price1Values = [price1 for _, price1, _ in prices]
+
+    return f"{len(prices)} hours from {prices[0][0]} to {prices[-1][0]}, price 1 between {min(price1Values)} and {max(price1Values)}"
+
+# Function to parse the content of a file of daily prices of a date (yyyymmdd) and add the prices of every hour to a points writer
+def storePrices(dateStr, content, writer):
+    prices = parsePrices(content)
+
+    writer.write_all(getPricePoints(prices))
+
+    logging.info(f"Prices of {dateStr}: {getPricesSummary(prices)}")
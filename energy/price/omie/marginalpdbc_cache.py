@@ -0,0 +1,106 @@
+##
+# Download of the OMIE "marginalpdbc" files used by the loaders, through a local cache of the files.
+# Published files do not change, so every file is stored once by date and version (.1 or .2),
+# compressed with gzip, and reprocessing past days does not need to download them again.
+# Files are stored in the directory cache/omie of BASE_PATH, or in OMIE_CACHE_PATH when it is set,
+# for example to run the loaders against a set of files prepared in advance.
+##
+import gzip
+import logging
+import os
+import requests
+from common import pipeline_metrics
+from common.atomic_files import open_atomic_file
+
+BASE_URL = "https://www.omie.es/es/file-download"
+
+# Versions of the files of a day, in the order they are requested to OMIE
+FILE_VERSIONS:tuple = ("1", "2")
+
+# Function to get the directory of the cache. Environment variables are read when it is used, once the .env file is loaded
+def getCacheDirectory():
+    return os.getenv("OMIE_CACHE_PATH") or os.path.join(os.getenv("BASE_PATH") or ".", "cache", "omie")
+
+# Function to get the path of the cached file of a date (yyyymmdd) and version
+def getCachedFilePath(dateStr, version):
+    return os.path.join(getCacheDirectory(), f"marginalpdbc_{dateStr}.{version}.gz")
+
+# Function to read the cached file of a date (yyyymmdd). Returns the version and the content, or (None, None) if it is not cached
+def readCachedFile(dateStr):
+    for version in FILE_VERSIONS:
+        cachedFilePath = getCachedFilePath(dateStr, version)
+        if os.path.exists(cachedFilePath):
+            with gzip.open(cachedFilePath, 'rb') as file:
+                content = file.read()
+
+            pipeline_metrics.increment("omie_cache_hits")
+            logging.debug(f"marginalpdbc_{dateStr}.{version} read from the cache {cachedFilePath}")
+
+            return version, content
+
+    pipeline_metrics.increment("omie_cache_misses")
+
+    return None, None
+
+# Function to store the content of the file of a date (yyyymmdd) and version in the cache.
+# The cache is not needed to load the prices, so errors are only logged
+def storeCachedFile(dateStr, version, content):
+    cachedFilePath = getCachedFilePath(dateStr, version)
+
+    try:
+        os.makedirs(os.path.dirname(cachedFilePath), exist_ok=True)
+
+        with open_atomic_file(cachedFilePath, "gzip") as file:
+            file.write(content)
+
+        logging.debug(f"marginalpdbc_{dateStr}.{version} stored in the cache {cachedFilePath}")
+
+    except OSError as e:
+        logging.error(f"Error storing marginalpdbc_{dateStr}.{version} in the cache: {e}")
+
+# Function to request a file of daily prices from OMIE with a function like requests.get
+def requestFile(fileName, get):
+    query_params = {
+        "parents[0]": "marginalpdbc",
+        "filename": fileName
+    }
+
+    response = get(BASE_URL, params=query_params)
+    pipeline_metrics.record_http_response(response)
+
+    return response
+
+# Function to get the file of daily prices of a date (yyyymmdd) from the cache or, if it is not cached, from OMIE.
+# Requests are sent with "get", a function like requests.get. Returns the content of the file or None if it is not available
+def fetchMarginalpdbc(dateStr, get=requests.get):
+    version, content = readCachedFile(dateStr)
+    if content:
+        return content
+
+    try:
+        with pipeline_metrics.stage("download"):
+            version = "1"
+            response = requestFile(f"marginalpdbc_{dateStr}.1", get)
+
+            # If the response with ".1" is empty, we try with ".2"
+            if not response.content:
+                logging.debug(f"Response with marginalpdbc_{dateStr}.1 is empty, trying with marginalpdbc_{dateStr}.2...")
+                version = "2"
+                response = requestFile(f"marginalpdbc_{dateStr}.2", get)
+
+        if response.status_code == 200:
+            # Check if the content type is 'application/octet-stream'
+            if response.headers.get('content-type') == 'application/octet-stream':
+                if response.content:
+                    logging.debug(f"Prices of {dateStr} found in marginalpdbc_{dateStr}.{version}")
+                    storeCachedFile(dateStr, version, response.content)
+                return response.content
+            else:
+                logging.error(f"The content type must be 'application/octet-stream'. Received {response.headers.get('content-type')}")
+        else:
+            logging.error(f"Failed to retrieve the resource. Status code: {response.status_code}")
+
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Request error: {e}")
+
+    return None
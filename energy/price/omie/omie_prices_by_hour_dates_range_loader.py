@@ -1,28 +1,37 @@
 ##
-# Script to load hourly energy prices from https://www.omie.es for a range of dates
+# Script to load hourly energy prices from https://www.omie.es for a range of dates.
+# Only the days whose prices are missing or incomplete in InfluxDB are loaded, unless all the days are requested.
+# Days are downloaded concurrently, with a limited number of requests in flight and a minimum time
+# between requests to the OMIE server, while they are stored one by one in the order of the dates.
 ##
 
 import requests
-import csv
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from influxdb import InfluxDBClient
 import logging
 import argparse
 import os
+import sys
+import threading
+import time
 from dotenv import load_dotenv
 
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common import pipeline_metrics
+from common.influxdb_session import get_influxdb_client, close_influxdb_client
+from common.influxdb_points_writer import InfluxDBPointsWriter
+from common.time_grid import get_hour_grid
+from marginalpdbc import MEASUREMENT, storePrices
+from marginalpdbc_cache import fetchMarginalpdbc
+
 # Load environment variables from the .env file in the current directory
 load_dotenv()
 
-BASE_URL = "https://www.omie.es/es/file-download"
 BASE_PATH = os.getenv("BASE_PATH")
-FILENAME = "marginalpdbc.csv"
-
-INFLUXDB_HOST = os.getenv("INFLUXDB_HOST")
-INFLUXDB_PORT = int(os.getenv("INFLUXDB_PORT"))
-INFLUXDB_DATABASE = os.getenv("INFLUXDB_DATABASE")
-INFLUXDB_USER = os.getenv("INFLUXDB_USER")
-INFLUXDB_PASSWORD = os.getenv("INFLUXDB_PASSWORD")
+INFLUXDB_WRITE_BATCH_SIZE = int(os.getenv("INFLUXDB_WRITE_BATCH_SIZE", "5000"))
+INFLUXDB_WRITE_FLUSH_INTERVAL = float(os.getenv("INFLUXDB_WRITE_FLUSH_INTERVAL", "10"))
 
 # Get the full path to the script
 script_path = __file__
@@ -30,10 +39,10 @@ script_path = __file__
 # Get the base name of the script (without extension)
 script_name = os.path.splitext(os.path.basename(script_path))[0]
 
-# Logging configuration
+# Logging configuration, one line by day at level INFO
 log_file_path = f"{BASE_PATH}/logs/{script_name}.log"
 log_format = "%(asctime)s - %(levelname)s - %(message)s"
-logging.basicConfig(filename=log_file_path, encoding='utf-8', level=logging.DEBUG, format=log_format)
+logging.basicConfig(filename=log_file_path, encoding='utf-8', level=logging.INFO, format=log_format)
 
 # Function to validate the date format
 def validate_date(date_str):
@@ -49,6 +58,9 @@ parser = argparse.ArgumentParser(description='Script to load hourly energy price
 # Define the expected arguments
 parser.add_argument('start_date', type=validate_date, help='Start date in "yyyy-mm-dd" format')
 parser.add_argument('end_date', type=validate_date, help='End date in "yyyy-mm-dd" format')
+parser.add_argument('--workers', type=int, default=int(os.getenv("OMIE_DOWNLOAD_WORKERS", "4")), help='Maximum number of days downloaded at the same time')
+parser.add_argument('--requests-per-second', type=float, default=float(os.getenv("OMIE_REQUESTS_PER_SECOND", "2")), help='Maximum number of requests per second sent to OMIE')
+parser.add_argument('--all', action='store_true', help='Load all the days of the range, also the days already stored')
 
 # Parse the command-line arguments
 args = parser.parse_args()
@@ -56,107 +68,122 @@ args = parser.parse_args()
 # Access the parsed arguments
 start_date = args.start_date
 end_date = args.end_date
+workers = max(1, args.workers)
+
+# Get the shared InfluxDB client
+influxDbClient = get_influxdb_client()
+
+# Points of all the days are written in batches instead of one request by hour
+priceWriter = InfluxDBPointsWriter(influxDbClient, batch_size=INFLUXDB_WRITE_BATCH_SIZE, flush_interval=INFLUXDB_WRITE_FLUSH_INTERVAL)
+
+# HTTP session shared by all the downloads, so connections to OMIE are reused
+httpSession = requests.Session()
+httpSession.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+
+##
+# Limit of the requests sent to a host: at most one request every "interval" seconds
+##
+class RateLimiter:
+
+    def __init__(self, requestsPerSecond):
+        self.interval = 1.0 / requestsPerSecond if requestsPerSecond > 0 else 0.0
+        self.nextRequestTime = 0.0
+        self.lock = threading.Lock()
 
-# Create an InfluxDB client
-influxDbClient = InfluxDBClient(host=INFLUXDB_HOST, port=INFLUXDB_PORT, database=INFLUXDB_DATABASE, username=INFLUXDB_USER, password=INFLUXDB_PASSWORD)
+    # Wait until a new request can be sent
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            waitSeconds = self.nextRequestTime - now
+            self.nextRequestTime = max(now, self.nextRequestTime) + self.interval
+
+        if waitSeconds > 0:
+            time.sleep(waitSeconds)
+
+omieRateLimiter = RateLimiter(args.requests_per_second)
 
 # Function to convert a date to "yyyymmdd" format
 def convert_to_yyyymmdd(date):
     return date.strftime("%Y%m%d")
 
-# Function to download the daily prices from OMIE
-def downloadFile(dateStr):
+# Function to send a request to OMIE through the shared session, respecting the limit of requests per second
+def rateLimitedGet(url, params=None):
+    omieRateLimiter.wait()
+    return httpSession.get(url, params=params)
+
+# Function to get the days of the range of dates
+def getDates(startDate, endDate):
+    currentDate = startDate
+    while currentDate <= endDate:
+        yield currentDate
+        currentDate += timedelta(days=1)
+
+# Function to get the number of hours stored by day for the range of dates, with a single query.
+# Prices are stored with the local hour of the day as UTC time, so the buckets of one day in UTC are the local days
+def getStoredHoursByDay(startDate, endDate):
+    query = f'SELECT COUNT("price1") FROM "{MEASUREMENT}" WHERE time >= \'{startDate.strftime("%Y-%m-%dT00:00:00Z")}\' AND time < \'{(endDate + timedelta(days=1)).strftime("%Y-%m-%dT00:00:00Z")}\' GROUP BY time(1d)'
+    with pipeline_metrics.stage("influxdb_read"):
+        result = influxDbClient.query(query)
+
+    return {point["time"][:10]: point["count"] or 0 for point in result.get_points()}
+
+# Function to get the days of the range of dates whose prices are missing or incomplete in InfluxDB
+def getMissingDates(startDate, endDate):
     try:
-        query_params = {
-            "parents[0]": "marginalpdbc",
-            "filename": f"marginalpdbc_{dateStr}.1"
-        }
-        response = requests.get(BASE_URL, params=query_params, stream=True)
-
-        # If the response with ".1" is empty, we try with ".2"
-        if not response.content:
-            logging.info(f"Response with marginalpdbc_{dateStr}.1 is empty, trying with marginalpdbc_{dateStr}.2...")
-            query_params = {
-                "parents[0]": "marginalpdbc",
-                "filename": f"marginalpdbc_{dateStr}.2"
-            }
-            response = requests.get(BASE_URL, params=query_params, stream=True)
-
-
-        if response.status_code == 200:
-            # Check if the content type is 'application/octet-stream'
-            if response.headers.get('content-type') == 'application/octet-stream':
-                # Specify the file where you want to save the binary data            
-
-                with open(FILENAME, 'wb') as output_file:
-                    for chunk in response.iter_content(chunk_size=1024):
-                        # Write the binary data to the file in chunks
-                        if chunk:
-                            output_file.write(chunk)
-
-                logging.info(f"Binary data saved to {FILENAME}")
-            else:
-                logging.error(f"The content type must be 'application/octet-stream'. Received {response.headers.get('content-type')}")
-        else:
-            logging.error(f"Failed to retrieve the resource. Status code: {response.status_code}")
-
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request error: {e}")
-
-def readFileAndStore():
-
-    # Read the CSV file and skip the first row (header)
-    with open(FILENAME, 'r') as file:
-        # Read the CSV data and skip the first row (header)
-        reader = csv.reader(file, delimiter=';')
-        next(reader)  # Skip the header row
-        for row in reader:
-            # Extract the first four fields and parse them into a datetime object
-            year, month, day, hour = map(int, row[0:4])
-            date = datetime(year, month, day, hour-1)
-
-            # Extract the other two fields and store them in separate variables
-            price1, price2 = map(float, row[4:6])
-
-            logging.info(f"Datetime: {date}, Price 1: {price1}, Price 2: {price1}")
-
-            price_hour_serie = [
-                {
-                    "measurement": "omie-daily-prices",
-                    "time": date,
-                    "fields": {
-                        "price1": price1,
-                        "price2": price2,
-                    }
-                }
-            ]
-
-            influxDbClient.write_points(price_hour_serie)
-
-            if (hour == 24):
-                break        
-
-def removeFile():
-    # Remove the file after processing
-    os.remove(FILENAME)
-    logging.info(f"{FILENAME} removed after processing")
-
-
-# Loop through the range of dates by day
-current_date = start_date
-while current_date <= end_date:
-    current_date_yyyymmdd = convert_to_yyyymmdd(current_date)
-    logging.info(f"Current Date (yyyymmdd): {current_date_yyyymmdd}")
-    
-    downloadFile(current_date_yyyymmdd)
-
-    readFileAndStore()
-
-    removeFile()
-
-    current_date += timedelta(days=1)
+        storedHours = getStoredHoursByDay(startDate, endDate)
+    except Exception as e:
+        logging.error(f"Error getting the days already stored, loading all the days: {e}")
+        return list(getDates(startDate, endDate))
+
+    hourGrid = get_hour_grid(startDate, endDate)
+
+    # Days have 23, 24 or 25 hours, but the 25th hour of the change to winter time is not stored
+    missingDates = [day for day, dayHours in zip(hourGrid.days, hourGrid.hours_per_day()) if storedHours.get(day.strftime("%Y-%m-%d"), 0) < min(int(dayHours), 24)]
+
+    pipeline_metrics.increment("omie_days_already_stored", len(hourGrid.days) - len(missingDates))
+    logging.info(f"{len(missingDates)} of {len(hourGrid.days)} days to load, the rest are already stored.")
+
+    return missingDates
+
+# Days are downloaded by a pool of threads, but stored in the order of the dates.
+# Only a window of days is requested ahead of the day being stored, so the downloaded files waiting to be stored are limited.
+try:
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pendingDownloads = deque()
+        dates = getDates(start_date, end_date) if args.all else iter(getMissingDates(start_date, end_date))
+
+        for current_date in dates:
+            pendingDownloads.append((current_date, executor.submit(fetchMarginalpdbc, convert_to_yyyymmdd(current_date), rateLimitedGet)))
+            if len(pendingDownloads) >= workers * 2:
+                break
+
+        while pendingDownloads:
+            current_date, download = pendingDownloads.popleft()
+
+            # Keep the window of downloads full
+            next_date = next(dates, None)
+            if next_date is not None:
+                pendingDownloads.append((next_date, executor.submit(fetchMarginalpdbc, convert_to_yyyymmdd(next_date), rateLimitedGet)))
+
+            current_date_yyyymmdd = convert_to_yyyymmdd(current_date)
+            logging.debug(f"Current Date (yyyymmdd): {current_date_yyyymmdd}")
+
+            # Files not available, or available but empty, are skipped
+            content = download.result()
+            if not content:
+                logging.error(f"Prices of {current_date_yyyymmdd} not loaded.")
+                continue
+
+            with pipeline_metrics.stage("influxdb_write"):
+                storePrices(current_date_yyyymmdd, content, priceWriter)
+finally:
+    # Write the points still in the buffer
+    with pipeline_metrics.stage("influxdb_write"):
+        priceWriter.close()
+
+pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
 
 # Close the InfluxDB connection
-influxDbClient.close()
+close_influxdb_client()
 
 logging.info("Process finished.")    
\ No newline at end of file
@@ -2,27 +2,25 @@
 # Script to load hourly energy prices from https://www.omie.es for a range of dates
 ##
 
-import requests
-import csv
 from datetime import datetime
 import pytz
-from influxdb import InfluxDBClient
 import logging
 import os
+import sys
 from dotenv import load_dotenv
 
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common import pipeline_metrics
+from common.influxdb_session import get_influxdb_client, close_influxdb_client
+from common.influxdb_points_writer import InfluxDBPointsWriter
+from marginalpdbc import storePrices
+from marginalpdbc_cache import fetchMarginalpdbc
+
 # Load environment variables from the .env file in the current directory
 load_dotenv()
 
-BASE_URL = "https://www.omie.es/es/file-download"
 BASE_PATH=os.getenv("BASE_PATH")
-FILENAME = "current_marginalpdbc.csv"
-
-INFLUXDB_HOST = os.getenv("INFLUXDB_HOST")
-INFLUXDB_PORT = int(os.getenv("INFLUXDB_PORT"))
-INFLUXDB_DATABASE = os.getenv("INFLUXDB_DATABASE")
-INFLUXDB_USER = os.getenv("INFLUXDB_USER")
-INFLUXDB_PASSWORD = os.getenv("INFLUXDB_PASSWORD")
 
 # Get the full path to the script
 script_path = __file__
@@ -35,91 +33,13 @@ log_file_path = f"{BASE_PATH}/logs/{script_name}.log"
 log_format = "%(asctime)s - %(levelname)s - %(message)s"
 logging.basicConfig(filename=log_file_path, encoding='utf-8', level=logging.DEBUG, format=log_format)
 
-# Create an InfluxDB client
-influxDbClient = InfluxDBClient(host=INFLUXDB_HOST, port=INFLUXDB_PORT, database=INFLUXDB_DATABASE, username=INFLUXDB_USER, password=INFLUXDB_PASSWORD)
+# Get the shared InfluxDB client
+influxDbClient = get_influxdb_client()
 
 # Function to convert a date to "yyyymmdd" format
 def convert_to_yyyymmdd(date):
     return date.strftime("%Y%m%d")
 
-# Function to download the daily prices from OMIE
-def downloadFile(dateStr):
-    try:
-        query_params = {
-            "parents[0]": "marginalpdbc",
-            "filename": f"marginalpdbc_{dateStr}.1"
-        }
-        response = requests.get(BASE_URL, params=query_params, stream=True)
-
-        # If the response with ".1" is empty, we try with ".2"
-        if not response.content:
-            logging.info(f"Response with marginalpdbc_{dateStr}.1 is empty, trying with marginalpdbc_{dateStr}.2...")
-            query_params = {
-                "parents[0]": "marginalpdbc",
-                "filename": f"marginalpdbc_{dateStr}.2"
-            }
-            response = requests.get(BASE_URL, params=query_params, stream=True)
-
-
-        if response.status_code == 200:
-            # Check if the content type is 'application/octet-stream'
-            if response.headers.get('content-type') == 'application/octet-stream':
-                # Specify the file where you want to save the binary data            
-
-                with open(FILENAME, 'wb') as output_file:
-                    for chunk in response.iter_content(chunk_size=1024):
-                        # Write the binary data to the file in chunks
-                        if chunk:
-                            output_file.write(chunk)
-
-                logging.info(f"Binary data saved to {FILENAME}")
-            else:
-                logging.error(f"The content type must be 'application/octet-stream'. Received {response.headers.get('content-type')}")
-        else:
-            logging.error(f"Failed to retrieve the resource. Status code: {response.status_code}")
-
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request error: {e}")
-
-def readFileAndStore():
-
-    # Read the CSV file and skip the first row (header)
-    with open(FILENAME, 'r') as file:
-        # Read the CSV data and skip the first row (header)
-        reader = csv.reader(file, delimiter=';')
-        next(reader)  # Skip the header row
-        for row in reader:
-            # Extract the first four fields and parse them into a datetime object
-            year, month, day, hour = map(int, row[0:4])
-            date = datetime(year, month, day, hour-1)
-
-            # Extract the other two fields and store them in separate variables
-            price1, price2 = map(float, row[4:6])
-
-            logging.info(f"Datetime: {date}, Price 1: {price1}, Price 2: {price1}")
-
-            price_hour_serie = [
-                {
-                    "measurement": "omie-daily-prices",
-                    "time": date,
-                    "fields": {
-                        "price1": price1,
-                        "price2": price2,
-                    }
-                }
-            ]
-
-            influxDbClient.write_points(price_hour_serie)
-
-            if (hour == 24):
-                break        
-
-def removeFile():
-    # Remove the file after processing
-    os.remove(FILENAME)
-    logging.info(f"{FILENAME} removed after processing")
-
-
 # Get current date
 # Specify the time zone for Madrid
 madrid_timezone = pytz.timezone('Europe/Madrid')
@@ -129,13 +49,19 @@ current_time = datetime.now(madrid_timezone)
 current_date_yyyymmdd = convert_to_yyyymmdd(current_time)
 logging.info(f"Current Date (yyyymmdd): {current_date_yyyymmdd}")
 
-downloadFile(current_date_yyyymmdd)
+content = fetchMarginalpdbc(current_date_yyyymmdd)
 
-readFileAndStore()
+# Files not available, or available but empty, are not stored
+if content:
+    # The prices of all the hours are written in a single request
+    with pipeline_metrics.stage("influxdb_write"), InfluxDBPointsWriter(influxDbClient) as priceWriter:
+        storePrices(current_date_yyyymmdd, content, priceWriter)
+else:
+    logging.error(f"Prices of {current_date_yyyymmdd} not loaded.")
 
-removeFile()
+pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
 
 # Close the InfluxDB connection
-influxDbClient.close()
+close_influxdb_client()
 
 logging.info("Process finished.")
\ No newline at end of file
@@ -4,11 +4,16 @@
 import requests
 from datetime import datetime, timedelta
 import pytz
-from influxdb import InfluxDBClient
 import logging
 import os
+import sys
 from dotenv import load_dotenv
 
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common import pipeline_metrics
+from common.influxdb_session import get_influxdb_client
+
 # Load environment variables from the .env file in the current directory
 load_dotenv()
 
@@ -20,12 +25,6 @@ PASSWORD = os.getenv("HUAWEI_PASSWORD")
 TOKEN_EXPIRATION = timedelta(minutes=30)
 STATION_CODE = os.getenv("HUAWEI_STATION_CODE")
 
-INFLUXDB_HOST = os.getenv("INFLUXDB_HOST")
-INFLUXDB_PORT = int(os.getenv("INFLUXDB_PORT"))
-INFLUXDB_DATABASE = os.getenv("INFLUXDB_DATABASE")
-INFLUXDB_USER = os.getenv("INFLUXDB_USER")
-INFLUXDB_PASSWORD = os.getenv("INFLUXDB_PASSWORD")
-
 BASE_PATH=os.getenv("BASE_PATH")
 
 # Get the full path to the script
@@ -47,6 +46,7 @@ def get_token():
         "systemCode": PASSWORD
     }
     response = requests.post(BASE_URL + LOGIN_ENDPOINT, json=login_data)
+    pipeline_metrics.record_http_response(response)
     if response.status_code == 200:
         return response.headers.get("xsrf-token")
     else:
@@ -61,6 +61,7 @@ def get_data(token, timestamp_milliseconds):
         "collectTime": timestamp_milliseconds
     }
     response = requests.post(BASE_URL + DATA_ENDPOINT, headers=headers, json=body)
+    pipeline_metrics.record_http_response(response)
     if response.status_code == 200:
         data = response.json()
 
@@ -73,7 +74,7 @@ def get_data(token, timestamp_milliseconds):
         raise Exception("Failed to fetch data")
     
 def insert_into_influxdb(data):
-    client = InfluxDBClient(host=INFLUXDB_HOST, port=INFLUXDB_PORT, database=INFLUXDB_DATABASE, username=INFLUXDB_USER, password=INFLUXDB_PASSWORD)
+    client = get_influxdb_client()
     json_data = data["data"]
     
     for entry in json_data:
@@ -91,8 +92,6 @@ def insert_into_influxdb(data):
         ]
         
         client.write_points(json_body)
-        
-    client.close()
 
 def getCurrentDate():
     # Get current date
@@ -103,7 +102,8 @@ def getCurrentDate():
 
 def main():
     try:
-        token = get_token()    
+        with pipeline_metrics.stage("login"):
+            token = get_token()
 
         current_date = getCurrentDate()
 
@@ -111,13 +111,17 @@ def main():
 
         timestamp_milliseconds = int(current_date.timestamp() * 1000)        
         
-        data = get_data(token, timestamp_milliseconds)            
+        with pipeline_metrics.stage("download"):
+            data = get_data(token, timestamp_milliseconds)
 
-        insert_into_influxdb(data)
+        with pipeline_metrics.stage("influxdb_write"):
+            insert_into_influxdb(data)
 
     except Exception as e:
         logging.error("Error:", e)        
 
+    pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
+
     logging.info(f"Process {script_name} finished.")
 
 if __name__ == "__main__":
@@ -4,12 +4,17 @@
 import requests
 # import time
 from datetime import datetime, timedelta
-from influxdb import InfluxDBClient
 import argparse
 import logging
 import os
+import sys
 from dotenv import load_dotenv
 
+# Make the modules shared by all the energy scripts available
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common import pipeline_metrics
+from common.influxdb_session import get_influxdb_client
+
 # Load environment variables from the .env file in the current directory
 load_dotenv()
 
@@ -21,12 +26,6 @@ PASSWORD = os.getenv("HUAWEI_PASSWORD")
 TOKEN_EXPIRATION = timedelta(minutes=30)
 STATION_CODE = os.getenv("HUAWEI_STATION_CODE")
 
-INFLUXDB_HOST = os.getenv("INFLUXDB_HOST")
-INFLUXDB_PORT = int(os.getenv("INFLUXDB_PORT"))
-INFLUXDB_DATABASE = os.getenv("INFLUXDB_DATABASE")
-INFLUXDB_USER = os.getenv("INFLUXDB_USER")
-INFLUXDB_PASSWORD = os.getenv("INFLUXDB_PASSWORD")
-
 BASE_PATH=os.getenv("BASE_PATH")
 
 # Get the full path to the script
@@ -69,6 +68,7 @@ def get_token():
         "systemCode": PASSWORD
     }
     response = requests.post(BASE_URL + LOGIN_ENDPOINT, json=login_data)
+    pipeline_metrics.record_http_response(response)
     if response.status_code == 200:
         return response.headers.get("xsrf-token")
     else:
@@ -83,6 +83,7 @@ def get_data(token, timestamp_milliseconds):
         "collectTime": timestamp_milliseconds
     }
     response = requests.post(BASE_URL + DATA_ENDPOINT, headers=headers, json=body)
+    pipeline_metrics.record_http_response(response)
     if response.status_code == 200:
         data = response.json()
 
@@ -94,7 +95,7 @@ def get_data(token, timestamp_milliseconds):
         raise Exception("Failed to fetch data")
     
 def insert_into_influxdb(data):
-    client = InfluxDBClient(host=INFLUXDB_HOST, port=INFLUXDB_PORT, database=INFLUXDB_DATABASE, username=INFLUXDB_USER, password=INFLUXDB_PASSWORD)
+    client = get_influxdb_client()
     json_data = data["data"]
     
     for entry in json_data:
@@ -115,12 +116,11 @@ def insert_into_influxdb(data):
         ]
         
         client.write_points(json_body)
-        
-    client.close()
 
 def main():
     try:
-        token = get_token()    
+        with pipeline_metrics.stage("login"):
+            token = get_token()
 
         current_date = start_date
         day_interval = timedelta(days=1)
@@ -131,14 +131,18 @@ def main():
 
             timestamp_milliseconds = int(current_date.timestamp() * 1000)        
             
-            data = get_data(token, timestamp_milliseconds)            
+            with pipeline_metrics.stage("download"):
+                data = get_data(token, timestamp_milliseconds)
 
-            insert_into_influxdb(data)
+            with pipeline_metrics.stage("influxdb_write"):
+                insert_into_influxdb(data)
 
             current_date += day_interval
     except Exception as e:
         logging.error("Error:", e)        
 
+    pipeline_metrics.write_run_summary(script_name, os.path.dirname(log_file_path))
+
     logging.info(f"Process {script_name} finished.")
 
 if __name__ == "__main__":